@@ -0,0 +1,70 @@
+""" Micro-benchmark for attribute access on resources, e.g. reading
+``entity.id`` in a loop over a large result set. It compares the current
+``__getattr__`` fallback with the previous approach of wrapping every
+lookup in ``__getattribute__``.
+
+    python benchmarks/attributes.py [number of entities]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from granoclient.entity import Entity
+
+
+class LegacyEntity(Entity):
+    """ An entity with the previous attribute lookup. """
+
+    __slots__ = ()
+
+    def __getattribute__(self, name):
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            if name != '_data' and self._data and name in self._data:
+                return self._data[name]
+            if name != '_data' and self._hydrate(name) and name in self._data:
+                return self._data[name]
+            raise
+
+
+def make(clazz, count):
+    return [clazz(None, {'id': unicode(i), 'schema': 'person',
+                         'project': 'test', 'properties': {}})
+            for i in xrange(count)]
+
+
+def scan_fields(entities):
+    for entity in entities:
+        entity.id
+        entity.properties
+
+
+def scan_slots(entities):
+    for entity in entities:
+        entity._complete
+        entity._data
+
+
+def scan_properties(entities):
+    for entity in entities:
+        entity.endpoint
+
+
+def main(count):
+    print 'Attribute access over %d entities, best of 5 runs (ms):' % count
+    print '%-12s %10s %10s %8s' % ('access', 'legacy', 'current', 'speedup')
+    legacy = make(LegacyEntity, count)
+    current = make(Entity, count)
+    for name, scan in (('fields', scan_fields), ('slots', scan_slots),
+                       ('properties', scan_properties)):
+        before = min(timeit.repeat(lambda: scan(legacy), number=1, repeat=5))
+        after = min(timeit.repeat(lambda: scan(current), number=1, repeat=5))
+        print '%-12s %10.1f %10.1f %7.1fx' % (name, before * 1000,
+                                              after * 1000, before / after)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,224 @@
+""" Benchmarks for the grano client, run against the in-process fake
+server in ``server.py``, so that results are reproducible and no real
+grano instance is needed.
+
+    python benchmarks/run.py [--latency 0.005] [--page-size 50] \\
+        [--records 2000] [--workers 4] [--json results.json] [scenario ...]
+
+Each scenario runs in a fresh interpreter, so that its peak memory use
+can be measured. For each one, the number of operations per second, the
+latency percentiles of the HTTP requests made and the peak resident
+memory are reported. Use ``--json`` to keep the results, e.g. to compare
+them across versions.
+"""
+import os
+import sys
+import json
+import time
+import random
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser, SUPPRESS_HELP
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yaml
+
+from granoclient import Grano
+from granoclient.common import materialize
+from granoclient.entity import Entity
+from granoclient.loader import Loader
+from server import FakeGrano
+
+
+SCENARIOS = ('paginate', 'paginate_dicts', 'load', 'load_cached',
+             'schemata', 'materialize')
+
+
+def setup(options):
+    server = FakeGrano(latency=options.latency,
+                       page_size=options.page_size).start()
+    grano = Grano(api_host=server.url, api_key='benchmark')
+    project = grano.projects.create({'slug': 'bench', 'label': 'Bench'})
+    return server, grano, project
+
+
+def fill(server, project, count):
+    # Write records straight into the store, so that only the benchmarked
+    # operation goes through the client.
+    for i in xrange(count):
+        server.store.save('entities', {
+            'project': project.slug,
+            'schema': 'person',
+            'properties': {'name': {'name': 'name', 'value': 'P%d' % i,
+                                    'active': True}}
+        })
+
+
+def paginate(server, grano, project, options):
+    fill(server, project, options.records)
+    count = 0
+    for entity in project.entities.all():
+        entity.id
+        count += 1
+    return count
+
+
+def paginate_dicts(server, grano, project, options):
+    fill(server, project, options.records)
+    collection = project.entities
+    collection.result_type = 'dict'
+    count = 0
+    for entity in collection.all():
+        entity['id']
+        count += 1
+    return count
+
+
+def _load(project, options, **kwargs):
+    loader = Loader(project, source_url='http://benchmark',
+                    workers=options.workers or None, **kwargs)
+    random.seed(42)
+    people = options.records / 2
+    for i in xrange(options.records):
+        person = loader.make_entity('person')
+        person.set('name', 'P%d' % random.randint(0, people))
+        person.save()
+        company = loader.make_entity('company')
+        company.set('name', 'C%d' % (i % 50))
+        company.save()
+        relation = loader.make_relation('employment', person, company)
+        relation.save()
+    report = loader.persist()
+    return report.saved
+
+
+def load(server, grano, project, options):
+    return _load(project, options)
+
+
+def load_cached(server, grano, project, options):
+    return _load(project, options, cache_size=options.records)
+
+
+def schemata(server, grano, project, options):
+    specs = [{
+        'name': 'type%d' % i,
+        'label': 'Type %d' % i,
+        'obj': 'entity',
+        'attributes': [{'name': 'attr%d' % j, 'label': 'Attribute %d' % j,
+                        'datatype': 'string'} for j in range(20)]
+    } for i in range(options.records / 20 or 1)]
+    fh = tempfile.NamedTemporaryFile(suffix='.yaml', delete=False)
+    try:
+        yaml.safe_dump(specs, fh)
+        fh.close()
+        # the first run creates the schemata, the second finds them as
+        # they are
+        project.schemata.upsert_from_file(fh.name)
+        project.schemata.upsert_from_file(fh.name)
+    finally:
+        os.unlink(fh.name)
+    return len(specs) * 2
+
+
+def materialize_(server, grano, project, options):
+    count = options.records * 10
+    data = [{'id': unicode(i), 'schema': {'name': 'person'},
+             'project': {'slug': 'bench'},
+             'properties': {'name': {'value': 'P%d' % i}}}
+            for i in xrange(count)]
+    objs = [materialize(grano.client, Entity, d) for d in data]
+    for obj in objs:
+        obj.id
+        obj.properties
+    return count
+
+
+def run_scenario(name, options):
+    server, grano, project = setup(options)
+    latencies = []
+    grano.client.hooks.add(
+        after_response=lambda m, u, r, elapsed: latencies.append(elapsed))
+    func = materialize_ if name == 'materialize' else globals()[name]
+    try:
+        start = time.time()
+        operations = func(server, grano, project, options)
+        elapsed = time.time() - start
+    finally:
+        grano.client.session.close()
+        server.stop()
+    latencies.sort()
+    return {
+        'scenario': name,
+        'operations': operations,
+        'seconds': elapsed,
+        'throughput': operations / elapsed if elapsed else 0.0,
+        'requests': len(latencies),
+        'p50': _percentile(latencies, 50),
+        'p90': _percentile(latencies, 90),
+        'p99': _percentile(latencies, 99),
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def _percentile(values, p):
+    if not len(values):
+        return None
+    index = int(round((len(values) - 1) * p / 100.0))
+    return values[index]
+
+
+def _ms(value):
+    return '-' if value is None else '%.1f' % (value * 1000)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [scenario ...]')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='server latency per request, in seconds')
+    parser.add_option('--page-size', type='int', default=50,
+                      help='server page size')
+    parser.add_option('--records', type='int', default=1000,
+                      help='number of records per scenario')
+    parser.add_option('--workers', type='int', default=0,
+                      help='loader worker threads')
+    parser.add_option('--json', help='write the results to this file')
+    parser.add_option('--child', action='store_true', help=SUPPRESS_HELP)
+    options, names = parser.parse_args()
+
+    if options.child:
+        print json.dumps(run_scenario(names[0], options))
+        return
+
+    names = names or SCENARIOS
+    args = [a for a in sys.argv[1:] if a not in names]
+    results = []
+    print '%-16s %8s %9s %10s %8s %8s %8s %10s' % (
+        'scenario', 'ops', 'seconds', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'peak MB')
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error('Unknown scenario: %s' % name)
+        output = subprocess.check_output([sys.executable, __file__,
+                                          '--child', name] + args)
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print '%-16s %8d %9.2f %10.1f %8s %8s %8s %10.1f' % (
+            name, result['operations'], result['seconds'],
+            result['throughput'], _ms(result['p50']), _ms(result['p90']),
+            _ms(result['p99']), result['peak_memory_kb'] / 1024.0)
+    if options.json:
+        with open(options.json, 'w') as fh:
+            json.dump({'options': {'latency': options.latency,
+                                   'page_size': options.page_size,
+                                   'records': options.records,
+                                   'workers': options.workers},
+                       'results': results}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+""" An in-memory stand-in for the grano API, for benchmarking the client
+without a real server. It implements the ``/projects``, ``/schemata``,
+``/entities`` and ``/relations`` endpoints closely enough for the client's
+collections, queries and loader, with a configurable latency per request
+and page size.
+
+    server = FakeGrano(latency=0.01, page_size=50)
+    server.start()
+    grano = Grano(api_host=server.url, api_key='benchmark')
+    ...
+    server.stop()
+"""
+import cgi
+import json
+import time
+import threading
+import itertools
+from urllib import urlencode
+from urlparse import urlparse, parse_qsl
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+PREFIX = '/api/1'
+
+
+class Store(object):
+    """ The records held by the fake server, with an index of property
+    values so that the loader's lookups don't need to scan all records. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.projects = {}
+        self.schemata = {}
+        self.records = {'entities': {}, 'relations': {}}
+        self.values = {'entities': {}, 'relations': {}}
+
+    def save(self, collection, data, id=None):
+        with self.lock:
+            records = self.records[collection]
+            if id is None:
+                id = unicode(next(self.ids))
+                obj = {'id': id, 'created_at': _now()}
+            else:
+                obj = records[id]
+                self._unindex(collection, obj)
+            obj.update(data)
+            obj['updated_at'] = _now()
+            for key in ('source', 'target'):
+                if key in obj and not isinstance(obj[key], dict):
+                    obj[key] = {'id': unicode(obj[key])}
+            if isinstance(obj.get('schema'), basestring):
+                obj['schema'] = {'name': obj['schema']}
+            records[id] = obj
+            self._index(collection, obj)
+            return obj
+
+    def _keys(self, obj):
+        for name, prop in (obj.get('properties') or {}).items():
+            if isinstance(prop, dict) and prop.get('value') is not None:
+                yield (name, unicode(prop['value']))
+
+    def _index(self, collection, obj):
+        for key in self._keys(obj):
+            self.values[collection].setdefault(key, set()).add(obj['id'])
+
+    def _unindex(self, collection, obj):
+        for key in self._keys(obj):
+            self.values[collection].get(key, set()).discard(obj['id'])
+
+    def query(self, collection, params):
+        with self.lock:
+            records = self.records[collection]
+            ids = None
+            for name, value in params.items():
+                if name.startswith('property-'):
+                    prop = name.split('-')[-1]
+                    found = self.values[collection].get((prop, value), set())
+                    ids = found if ids is None else ids & found
+            if ids is None:
+                candidates = records.values()
+            else:
+                candidates = [records[i] for i in ids]
+            results = []
+            for obj in candidates:
+                if 'project' in params and \
+                        obj.get('project') != params['project']:
+                    continue
+                if 'source' in params and \
+                        obj['source']['id'] != params['source']:
+                    continue
+                if 'target' in params and \
+                        obj['target']['id'] != params['target']:
+                    continue
+                results.append(obj)
+        results.sort(key=lambda o: int(o['id']))
+        return results
+
+
+class FakeGrano(ThreadingMixIn, HTTPServer):
+    """ A threaded HTTP server on a free port of ``localhost``.
+
+    :param latency: (optional) seconds to wait before each response.
+    :param page_size: (optional) the default and maximum number of
+        results per page.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, page_size=20, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.page_size = page_size
+        self.store = Store()
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, delayed ACKs
+    # add ~40ms to each response on a persistent connection.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def handle_api(self, method):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = dict((k, v.decode('utf-8'))
+                      for k, v in parse_qsl(url.query))
+        path = url.path[len(PREFIX):].strip('/').split('/')
+        data = self.read_data() if method == 'POST' else None
+        try:
+            status, body = self.route(method, path, params, data)
+        except KeyError:
+            status, body = 404, {'status': 404, 'message': 'Not found.'}
+        except ValueError as exc:
+            status, body = 400, {'status': 400, 'message': unicode(exc)}
+        self.respond(status, body)
+
+    def read_data(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if self.headers.gettype() == 'multipart/form-data':
+            form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                    environ={'REQUEST_METHOD': 'POST'})
+            return json.loads(form.getfirst('data'))
+        form = dict(parse_qsl(self.rfile.read(length)))
+        return json.loads(form['data'])
+
+    def respond(self, status, body):
+        body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, method, path, params, data):
+        store = self.server.store
+        if path[0] == 'projects':
+            if len(path) == 1:
+                if method == 'POST':
+                    store.projects[data['slug']] = data
+                    return 201, data
+                return self.page(path, params, store.projects.values())
+            project = store.projects[path[1]]
+            if len(path) == 2:
+                if method == 'POST':
+                    project.update(data)
+                return 200, project
+            schemata = store.schemata.setdefault(path[1], {})
+            if len(path) == 3:
+                if method == 'POST':
+                    schemata[data['name']] = data
+                    return 201, data
+                return self.page(path, params, schemata.values())
+            if method == 'POST':
+                schemata[path[3]].update(data)
+            return 200, schemata[path[3]]
+        if path[0] in ('entities', 'relations'):
+            if len(path) == 1:
+                if method == 'POST':
+                    if not data.get('schema'):
+                        raise ValueError('No schema given.')
+                    return 201, store.save(path[0], data)
+                results = store.query(path[0], params)
+                return self.page(path, params, results)
+            if method == 'POST':
+                return 200, store.save(path[0], data, id=path[1])
+            return 200, store.records[path[0]][path[1]]
+        raise KeyError(path[0])
+
+    def page(self, path, params, results):
+        limit = min(int(params.get('limit', self.server.page_size)),
+                    self.server.page_size)
+        offset = int(params.get('offset', 0))
+
+        def link(offset):
+            query = dict(params, limit=limit, offset=offset)
+            query = [(k, unicode(v).encode('utf-8'))
+                     for k, v in sorted(query.items())]
+            return '%s%s/%s?%s' % (self.server.url, PREFIX, '/'.join(path),
+                                   urlencode(query))
+
+        return 200, {
+            'results': results[offset:offset + limit],
+            'total': len(results),
+            'next_url': link(offset + limit)
+                if offset + limit < len(results) else None,
+            'prev_url': link(max(0, offset - limit)) if offset > 0 else None
+        }
+
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S')
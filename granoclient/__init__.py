@@ -1,11 +1,15 @@
 from granoclient.base import GranoException, GranoServerException
 from granoclient.base import NotFound, InvalidRequest
 from granoclient.base import Client
+from granoclient.asyncclient import AsyncClient
 from granoclient.common import Query
 from granoclient.project import Project, ProjectCollection
 from granoclient.schema import Schema, SchemaCollection
 from granoclient.entity import Entity, EntityCollection
-from granoclient.relation import Relation, RelationCollection
+from granoclient.relation import Relation, RelationCollection, RelationQuery
+from granoclient.graph import Traversal
+from granoclient.snapshot import Snapshot
+from granoclient.sync import Mirror
 
 
 class Grano(object):
@@ -23,11 +27,15 @@ class Grano(object):
         requests.
     :param api_prefix: (optional) path prefix of the grano API, usually
         ``/api/1/``.
+
+    Further keyword arguments configure the network settings of the
+    :class:`granoclient.Client`, such as ``timeout`` and ``retries``.
     """
 
-    def __init__(self, api_host=None, api_key=None, api_prefix='/api/1/'):
+    def __init__(self, api_host=None, api_key=None, api_prefix='/api/1/',
+                 **kwargs):
         self.client = Client(api_host=api_host, api_key=api_key,
-            api_prefix=api_prefix)
+            api_prefix=api_prefix, **kwargs)
 
     @property
     def projects(self):
@@ -71,3 +79,31 @@ class Grano(object):
     def __repr__(self):
         return '<Grano(%s)>' % self.client.api_host
 
+
+class AsyncGrano(Grano):
+    """ A variant of the grano client library which can also run requests
+    in the background, e.g. to load many entities by id at once::
+
+        tasks = [client.entities.by_id_async(id) for id in ids]
+        entities = client.gather(tasks)
+
+    All blocking methods of :class:`granoclient.Grano` remain available.
+
+    :param concurrency: (optional) the maximum number of requests which are
+        run at the same time.
+    """
+
+    def __init__(self, api_host=None, api_key=None, api_prefix='/api/1/',
+                 concurrency=10, **kwargs):
+        self.client = AsyncClient(api_host=api_host, api_key=api_key,
+            api_prefix=api_prefix, concurrency=concurrency, **kwargs)
+
+    def gather(self, tasks):
+        """ Wait for a set of background tasks and return their results
+        in order. """
+        return self.client.gather(tasks)
+
+    def close(self):
+        """ Wait for all pending requests and stop the worker threads. """
+        self.client.close()
+
@@ -0,0 +1,46 @@
+from granoclient.base import Client
+from granoclient.pool import WorkerPool
+
+
+class AsyncClient(Client):
+    """ A client which, in addition to the blocking ``get`` and ``post``
+    methods, can run requests in the background. At most ``concurrency``
+    requests are in flight at any time; further requests are queued and
+    block the caller once the queue is full. Responses are handled by the
+    same ``evaluate`` logic as for blocking requests. Do not instantiate
+    directly, use ``AsyncGrano`` instead. """
+
+    def __init__(self, api_host, api_key, api_prefix='/api/1/',
+                 concurrency=10, **kwargs):
+        super(AsyncClient, self).__init__(api_host, api_key,
+                                          api_prefix=api_prefix, **kwargs)
+        self.concurrency = concurrency
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = WorkerPool(self.concurrency)
+        return self._pool
+
+    def get_async(self, endpoint, params={}):
+        """ Start a GET request and return a
+        :class:`granoclient.pool.Task`; its ``get()`` method returns the
+        ``(status, data)`` tuple of the response. """
+        return self.pool.submit(self.get, endpoint, params=params)
+
+    def post_async(self, endpoint, data={}, files={}):
+        """ Start a POST request and return a
+        :class:`granoclient.pool.Task`. """
+        return self.pool.submit(self.post, endpoint, data=data, files=files)
+
+    def gather(self, tasks):
+        """ Wait for a set of tasks and return their results in order.
+        The first exception raised by any of the tasks is re-raised. """
+        return [task.get() for task in tasks]
+
+    def close(self):
+        """ Wait for all pending requests and stop the worker threads. """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -1,8 +1,25 @@
 from ConfigParser import SafeConfigParser
 import json
 import os
+import time
+import random
+import weakref
+import logging
+from threading import Lock
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from granoclient.limiter import RateLimiter
+from granoclient.metrics import Hooks, Metrics
+from granoclient.replay import Recorder, ReplayAdapter
+
+
+log = logging.getLogger(__name__)
+
+# Rate limiting and gateway errors, which are usually transient, e.g.
+# during a server restart.
+RETRY_STATUS = (429, 502, 503, 504)
 
 
 class GranoException(Exception):
@@ -49,9 +66,53 @@ class NotFound(GranoServerException): pass
 
 class Client(object):
     """ Grano client class; handles configuration and network
-    settings. Do not instantiate directly, use ``Grano`` instead. """
+    settings. Do not instantiate directly, use ``Grano`` instead.
+
+    Apart from the host and API key, the following network settings can be
+    given as keyword arguments, in ``~/.grano.ini`` or as ``GRANO_*``
+    environment variables (e.g. ``GRANO_TIMEOUT``):
+
+    :param timeout: (optional) seconds to wait for the server to respond.
+    :param retries: (optional) how often to retry a GET request which
+        failed with a connection error, a timeout, rate limiting (429) or
+        a gateway error (502, 503, 504). Defaults to 3.
+    :param backoff: (optional) the base delay in seconds before a retry.
+        The delay doubles with each attempt and is randomized (jitter) to
+        keep clients from retrying in lockstep. Defaults to 0.5.
+    :param pool_connections: (optional) the number of hosts for which
+        connection pools are kept. Defaults to 10.
+    :param pool_maxsize: (optional) the number of connections kept open
+        to each host; this should be at least the number of threads making
+        requests. Defaults to 10.
+    :param rate_limit: (optional) the maximum number of requests per second
+        sent by this client.
+    :param limiter: (optional) a :class:`granoclient.limiter.RateLimiter`,
+        which may be shared with other clients. Takes precedence over
+        ``rate_limit``.
+    :param cache: (optional) a :class:`granoclient.cache.ResponseCache`
+        used to store the responses to ``GET`` requests.
+    :param hooks: (optional) a :class:`granoclient.metrics.Hooks` with
+        callbacks to invoke around each request.
+    :param record: (optional) the name of a file to which all requests and
+        responses are written, see :class:`granoclient.replay.Recorder`.
+        The recorder is available as ``recorder`` and must be closed once
+        the recording is complete.
+    :param replay: (optional) the name of a recording from which responses
+        are served instead of sending requests to the server, see
+        :class:`granoclient.replay.ReplayAdapter`.
+    :param replay_speed: (optional) how much faster than recorded the
+        responses are served; ``0`` serves them without delay. Defaults
+        to 1.0.
 
-    def __init__(self, api_host, api_key, api_prefix='/api/1/'):
+    Statistics on all requests are collected in ``metrics``, a
+    :class:`granoclient.metrics.Metrics`.
+    """
+
+    def __init__(self, api_host, api_key, api_prefix='/api/1/', timeout=None,
+                 retries=None, backoff=None, pool_connections=None,
+                 pool_maxsize=None, rate_limit=None, limiter=None,
+                 cache=None, hooks=None, record=None, replay=None,
+                 replay_speed=None):
         config = SafeConfigParser()
         config.read([os.path.expanduser('~/.grano.ini')])
         if config.has_section('client'):
@@ -59,6 +120,12 @@ class Client(object):
         else:
             config = {}
 
+        def setting(value, name, default, cast):
+            if value is None:
+                value = os.environ.get('GRANO_' + name.upper(),
+                    config.get(name))
+            return default if value is None else cast(value)
+
         if not api_host:
             api_host = os.environ.get('GRANO_HOST',
                 config.get('host', 'http://localhost:5000'))
@@ -72,6 +139,30 @@ class Client(object):
         self.api_host = api_host
         self.api_key = api_key
         self.api_prefix = api_prefix
+        self.timeout = setting(timeout, 'timeout', None, float)
+        self.retries = setting(retries, 'retries', 3, int)
+        self.backoff = setting(backoff, 'backoff', 0.5, float)
+        self.pool_connections = setting(pool_connections,
+            'pool_connections', 10, int)
+        self.pool_maxsize = setting(pool_maxsize, 'pool_maxsize', 10, int)
+        rate_limit = setting(rate_limit, 'rate_limit', None, float)
+        if limiter is None and rate_limit:
+            limiter = RateLimiter(rate=rate_limit,
+                                  max_concurrency=self.pool_maxsize)
+        self.limiter = limiter
+        self.cache = cache
+        self.hooks = hooks or Hooks()
+        self.metrics = Metrics()
+        self.recorder = None
+        record = setting(record, 'record', None, str)
+        if record:
+            self.recorder = Recorder(record)
+            self.hooks.add(after_response=self.recorder)
+        self.replay = setting(replay, 'replay', None, str)
+        self.replay_speed = setting(replay_speed, 'replay_speed', 1.0, float)
+        # Live resource objects by type and key, see ``materialize``.
+        self.identities = weakref.WeakValueDictionary()
+        self.identities_lock = Lock()
 
     @property
     def session(self):
@@ -79,8 +170,16 @@ class Client(object):
             headers = {'Accept': 'application/json'}
             if self.api_key:
                 headers['X-Grano-API-Key'] = self.api_key
-            self._session = requests.Session()
-            self._session.headers.update(headers)
+            session = requests.Session()
+            session.headers.update(headers)
+            if self.replay:
+                adapter = ReplayAdapter(self.replay, speed=self.replay_speed)
+            else:
+                adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
         return self._session
 
     def path(self, endpoint):
@@ -90,9 +189,18 @@ class Client(object):
             endpoint = endpoint[1:]
         return self.api_host + self.api_prefix + endpoint
 
+    def endpoint(self, url):
+        """ The API path of a URL, i.e. the reverse of ``path``. """
+        url = url.split('?', 1)[0]
+        base = self.api_host + self.api_prefix
+        if url.startswith(base):
+            return '/' + url[len(base):]
+        return url
+
     def evaluate(self, response):
         try:
-            data = response.json()
+            with self.metrics.timed('decode'):
+                data = response.json()
         except ValueError:
             raise GranoException('Server did not respond with JSON data.')
         if response.status_code == 400:
@@ -103,12 +211,130 @@ class Client(object):
             raise GranoServerException(data)
         return response.status_code, data
 
+    def _send(self, method, url, **kwargs):
+        self.hooks.fire('before_request', method, url, kwargs)
+        if self.limiter is not None:
+            self.limiter.acquire()
+        status, start = None, time.time()
+        try:
+            response = self.session.request(method, url,
+                                            timeout=self.timeout, **kwargs)
+            status = response.status_code
+        except Exception as exc:
+            elapsed = time.time() - start
+            self.metrics.error(method, self.endpoint(url), exc)
+            self.hooks.fire('on_error', method, url, exc, elapsed)
+            raise
+        finally:
+            if self.limiter is not None:
+                self.limiter.release(time.time() - start, status)
+        elapsed = time.time() - start
+        received = 0
+        if not kwargs.get('stream'):
+            received = len(response.content or '')
+        self.metrics.response(method, self.endpoint(url), status, elapsed,
+                              sent=_body_size(response),
+                              received=received)
+        self.hooks.fire('after_response', method, url, response, elapsed)
+        return response
+
+    def _get(self, url, **kwargs):
+        # GET requests are idempotent, so transient failures are retried
+        # with an exponential, randomized backoff.
+        attempt = 0
+        while True:
+            try:
+                response = self._send('GET', url, **kwargs)
+                if response.status_code not in RETRY_STATUS or \
+                        attempt >= self.retries:
+                    return response
+                reason = 'status %s' % response.status_code
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= self.retries:
+                    raise
+                reason = repr(exc)
+            attempt += 1
+            self.metrics.retry('GET', self.endpoint(url))
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            log.info('Retrying %s (%s) in %.2fs.', url, reason, delay)
+            time.sleep(delay)
+
     def get(self, endpoint, params={}):
-        response = self.session.get(self.path(endpoint), params=params)
-        return self.evaluate(response)
+        url = self.path(endpoint)
+        if self.cache is None:
+            return self.evaluate(self._get(url, params=params))
+
+        key = self.cache.key(url, params)
+        entry, fresh = self.cache.lookup(key)
+        if entry is not None and not fresh:
+            headers = self.cache.validators(entry)
+            response = self._get(url, params=params, headers=headers)
+            if response.status_code == 304:
+                self.cache.refresh(key, entry)
+                fresh = True
+        elif entry is None:
+            response = self._get(url, params=params)
+        if fresh:
+            # decode a new copy, so callers can't modify the cached data
+            with self.metrics.timed('decode'):
+                return entry['status'], json.loads(entry['body'])
+        status, data = self.evaluate(response)
+        # Errors which evaluate() lets through (e.g. a 503 without an error
+        # body, once retries are used up) must not be served from the cache.
+        if response.ok:
+            self.cache.store(key, response, status, data)
+        return status, data
+
+    def stream(self, endpoint, params={}, chunk_size=16384):
+        """ Like ``get``, but instead of decoding the response, return an
+        iterator over the chunks of its body as they are received. """
+        url = self.path(endpoint)
+        response = self._get(url, params=params, stream=True)
+        if not response.ok:
+            self.evaluate(response)
+            raise GranoException('Server responded with status %s.' %
+                                 response.status_code)
+        return response.status_code, self._iter_body(url, response,
+                                                     chunk_size)
+
+    def _iter_body(self, url, response, chunk_size):
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            response.close()
+            self.metrics.received('GET', self.endpoint(url), size)
 
     def post(self, endpoint, data={}, files={}):
-        data = {'data': json.dumps(data)}
-        response = self.session.post(self.path(endpoint),
-            allow_redirects=True, data=data, files=files)
+        with self.metrics.timed('encode'):
+            data = {'data': json.dumps(data)}
+        url = self.path(endpoint)
+        response = self._send('POST', url, allow_redirects=True, data=data,
+                              files=files)
+        if self.cache is not None:
+            self._invalidate(url)
         return self.evaluate(response)
+
+    def _invalidate(self, url):
+        # Paths alternate between collections and keys, e.g.
+        # ``projects/{slug}/schemata``. A write to a collection (i.e. a
+        # create) drops its listings; a write to a resource drops the cached
+        # versions of it and the listings of its collection, but not the
+        # other resources in that collection.
+        path = url[len(self.api_host + self.api_prefix):].strip('/')
+        if len(path.split('/')) % 2:
+            self.cache.invalidate(url, nested=False)
+        else:
+            self.cache.invalidate(url)
+            self.cache.invalidate(url.rsplit('/', 1)[0], nested=False)
+
+
+def _body_size(response):
+    # The size of the request body which was sent, if it is known.
+    body = getattr(getattr(response, 'request', None), 'body', None)
+    if isinstance(body, basestring):
+        return len(body)
+    return 0
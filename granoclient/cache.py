@@ -0,0 +1,219 @@
+import json
+import time
+import sqlite3
+from urllib import urlencode
+from threading import Lock
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A thread-safe mapping of bounded size. Once it is full, the least
+    recently used entries are evicted. Lookups are counted as ``hits`` and
+    ``misses``.
+
+    :param size: the maximum number of entries to keep.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """ Get an entry and mark it as recently used. """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Add or replace an entry, evicting old entries if needed. """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ Remove an entry and return it. """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    @property
+    def stats(self):
+        """ A dictionary with the cache size and hit/miss counts. """
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '<LRUCache(%d/%d, %d hits, %d misses)>' % \
+            (len(self), self.size, self.hits, self.misses)
+
+
+class MemoryBackend(object):
+    """ Keeps cached responses in memory, evicting the least recently used
+    ones once ``size`` responses are stored. """
+
+    def __init__(self, size=1000):
+        self.entries = LRUCache(size)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        self.entries.set(key, entry)
+
+    def invalidate(self, url, nested=False):
+        prefixes = _prefixes(url, nested)
+        for key in self.entries.keys():
+            if key == url or key.startswith(prefixes):
+                self.entries.pop(key)
+
+
+class DiskBackend(object):
+    """ Keeps cached responses in an SQLite database, so that they can be
+    re-used across runs. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses '
+                           '(key TEXT PRIMARY KEY, entry TEXT)')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            cur = self._conn.execute('SELECT entry FROM responses '
+                                     'WHERE key = ?', (key,))
+            row = cur.fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def set(self, key, entry):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses (key, entry) '
+                               'VALUES (?, ?)', (key, json.dumps(entry)))
+            self._conn.commit()
+
+    def invalidate(self, url, nested=False):
+        # Prefixes are matched as key ranges, so that the primary key index
+        # is used rather than scanning the table.
+        with self._lock:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (url,))
+            for prefix in _prefixes(url, nested):
+                self._conn.execute('DELETE FROM responses WHERE key >= ? '
+                                   'AND key < ?',
+                                   (prefix, prefix[:-1] +
+                                    chr(ord(prefix[-1]) + 1)))
+            self._conn.commit()
+
+
+def _prefixes(url, nested):
+    # Cache keys which start with these belong to the URL.
+    if nested:
+        return (url + '?', url + '/')
+    return (url + '?',)
+
+
+class ResponseCache(object):
+    """ An opt-in cache for the ``GET`` requests of a
+    :class:`granoclient.Client`, keyed by URL and query parameters::
+
+        grano = Grano(cache=ResponseCache(ttl=300))
+
+    Responses are re-used for ``ttl`` seconds. After that, they are
+    revalidated with the server using ``If-None-Match`` or
+    ``If-Modified-Since``, if the server sent an ``ETag`` or
+    ``Last-Modified`` header. Writes to a resource invalidate the cached
+    responses for it and for the collection it belongs to.
+
+    :param backend: (optional) a :class:`MemoryBackend` (the default) or a
+        :class:`DiskBackend`.
+    :param ttl: (optional) the number of seconds for which a response is
+        used without asking the server.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def key(self, url, params):
+        if not params:
+            return url
+        params = [(k, unicode(v).encode('utf-8')) for k, v in params.items()]
+        return url + '?' + urlencode(sorted(params))
+
+    def lookup(self, key):
+        """ Get a cached entry, and whether it is still fresh. """
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+        fresh = time.time() < entry['expires']
+        if fresh:
+            self.hits += 1
+        return entry, fresh
+
+    def validators(self, entry):
+        """ The headers needed to revalidate a cached entry. """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, response, status, data):
+        entry = {
+            'status': status,
+            'body': json.dumps(data),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'expires': time.time() + self.ttl
+        }
+        self.backend.set(key, entry)
+
+    def refresh(self, key, entry):
+        """ Mark an entry as fresh after the server confirmed that it has
+        not been modified. """
+        self.revalidated += 1
+        entry['expires'] = time.time() + self.ttl
+        self.backend.set(key, entry)
+
+    def invalidate(self, url, nested=True):
+        """ Drop all cached responses for the given URL, including those
+        with query parameters.
+
+        :param nested: (optional) also drop the responses for resources
+            nested below the URL. Set this to ``False`` to only drop a
+            collection listing, but not its members.
+        """
+        self.backend.invalidate(url, nested=nested)
+
+    def __repr__(self):
+        return '<ResponseCache(%d hits, %d misses, %d revalidated)>' % \
+            (self.hits, self.misses, self.revalidated)
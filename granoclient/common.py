@@ -1,71 +1,268 @@
 import os
+import json
+import time
+import hashlib
+import logging
+import weakref
+import threading
 import mimetypes
+from Queue import Queue, Full
+from collections import namedtuple
+
+from granoclient.base import GranoException, InvalidRequest
+from granoclient.pool import WorkerPool
+from granoclient.stream import iter_array
+
+
+log = logging.getLogger(__name__)
+
+# The kinds of objects a query can return; see ``Query.dicts`` and
+# ``Query.records``.
+RESULT_TYPES = ('resource', 'dict', 'record')
 
 
 class GranoObject(object):
     """ Base class for objects to layer over the grano REST API. """
 
+    # Resources are created for every result of a query, so they keep their
+    # state in slots rather than an instance dictionary.
+    __slots__ = ('client', '_data', '_changed', '__weakref__')
+
     def __init__(self, client, data):
         self.client = client
         self._data = data
-
-    def __getattribute__(self, name):
-        try:
-            return object.__getattribute__(self, name)
-        except AttributeError:
-            if name != '_data' and self._data and name in self._data:
-                return self._data[name]
-            raise
+        self._changed = None
+
+    def __getattr__(self, name):
+        # Only called once the regular lookup has failed, so that slots,
+        # properties and methods are resolved at full speed; fields of the
+        # server representation are the fallback.
+        if name == '_data' or name.startswith('__'):
+            raise AttributeError(name)
+        data = self._data
+        if data and name in data:
+            return data[name]
+        if self._hydrate(name) and name in self._data:
+            return self._data[name]
+        raise AttributeError("%r object has no attribute %r" %
+                             (self.__class__.__name__, name))
 
     def __setattr__(self, name, value):
-        if hasattr(self, '_data') and self._data is not None \
-                and name in self._data.keys():
-            self._data[name] = value
+        data = getattr(self, '_data', None)
+        # viewkeys() is a constant-time membership test which, like keys(),
+        # fails for data which is not a dictionary.
+        if data is not None and name in data.viewkeys():
+            data[name] = value
+            self._touch(name)
         else:
-            return object.__setattr__(self, name, value)
+            try:
+                return object.__setattr__(self, name, value)
+            except AttributeError:
+                raise AttributeError('%s has no field %r; use item '
+                                     'assignment to add one.' %
+                                     (self.__class__.__name__, name))
 
     def __getitem__(self, name):
-        return self._data[name]
+        try:
+            return self._data[name]
+        except KeyError:
+            if self._hydrate(name):
+                return self._data[name]
+            raise
 
     def get(self, name, default=None):
+        """ Get a field, or ``default`` if it is missing. Unlike attribute
+        and item access, this never loads the full representation of a
+        shortened resource, so optional fields can be read cheaply. """
         return self._data.get(name, default)
 
     def __setitem__(self, name, value):
         self._data[name] = value
+        self._touch(name)
+
+    def _touch(self, name):
+        if self._changed is None:
+            self._changed = set()
+        self._changed.add(name)
+
+    def _hydrate(self, name):
+        # Hook to load missing fields on demand; see GranoResource.
+        return False
 
 
 class GranoResource(GranoObject):
     """ A specific resource that is part of the grano API. """
 
     resource_key = 'id'
+    # Whether there should only be one live object per resource key and
+    # client; see ``materialize``.
+    identity_mapped = False
+    # Fields which the server validates on every update, and which are
+    # therefore sent with partial saves as well; see ``changes``.
+    required_fields = ()
+
+    __slots__ = ('_files', '_digest', '_changed_properties', '_complete',
+                 '_siblings')
 
     def __init__(self, *args, **kwargs):
         super(GranoResource, self).__init__(*args, **kwargs)
-        self._files = {}
+        # Files to upload on the next save, created when one is added.
+        self._files = None
+        self._digest = None
+        self._changed_properties = None
+        self._complete = False
+        self._siblings = None
+
+    def _hydrate(self, name):
+        # Shortened representations (e.g. from query results) are traded in
+        # for the full resource the first time a missing field is accessed.
+        if name.startswith('_') or self._complete or self._data is None \
+                or self.resource_key not in self._data:
+            return False
+        if self._siblings is not None:
+            self._siblings.hydrate(self)
+        else:
+            self.reload()
+        return True
+
+    def _hash(self):
+        data = json.dumps(self._data, sort_keys=True)
+        return hashlib.sha1(data).hexdigest()
+
+    def _pending(self):
+        # Whether there are local changes which haven't been saved, whether
+        # tracked or made to nested values (detected through the digest).
+        if self._changed or self._changed_properties or self._files:
+            return True
+        return self._digest is not None and self._hash() != self._digest
+
+    def mark_clean(self):
+        """ Remember the current state of the resource as the version held
+        by the server. This is done automatically whenever the resource is
+        fetched individually or saved. """
+        self._digest = self._hash()
+        self._changed = None
+        self._changed_properties = None
+
+    @property
+    def is_dirty(self):
+        """ Check if the resource has been modified since it was last
+        fetched from or saved to the server. Resources which are part of a
+        query result have no known server state and are always considered
+        to be dirty. """
+        if self._digest is None or self._files or self._changed or \
+                self._changed_properties:
+            return True
+        return self._hash() != self._digest
+
+    @property
+    def changes(self):
+        """ A partial representation of the resource, which contains only
+        the fields and properties that were set since it was last fetched
+        from or saved to the server, along with the fields the server
+        requires for any update (e.g. the ``schema`` of an entity). Changes
+        made to nested values, such as
+        ``entity['properties']['name']['value']``, are not tracked. """
+        data = dict((k, self._data[k]) for k in self._changed or [])
+        if self._changed_properties and 'properties' not in data:
+            properties = self._data.get('properties', {})
+            data['properties'] = dict((n, properties[n]) for n in
+                                      self._changed_properties
+                                      if n in properties)
+        if len(data) or self._files:
+            for name in self.required_fields:
+                if name in self._data and name not in data:
+                    data[name] = self._data[name]
+        return data
+
+    def update_properties(self, properties):
+        """ Set several properties at once, marking them as modified.
+
+        :param properties: a dictionary of property names and property
+            objects (i.e. dictionaries with a ``value`` and a ``source_url``).
+        """
+        self._data.setdefault('properties', {}).update(properties)
+        if self._changed_properties is None:
+            self._changed_properties = set()
+        self._changed_properties.update(properties.keys())
+
+    def set_property(self, name, value, source_url=None, **fields):
+        """ Set the value of a property, marking it as modified.
+
+        :param name: the name of the property.
+        :param value: the new value of the property.
+        :param source_url: (optional) a URL which will be set as the origin
+            of this information.
+        """
+        prop = {
+            'name': name,
+            'value': value,
+            'source_url': source_url,
+            'active': True
+        }
+        prop.update(fields)
+        self.update_properties({name: prop})
 
     def reload(self):
         """ Reload the resource from the server. This is useful when the
         resource is a shortened index representation which needs to be
         traded in for a complete representation of the resource."""
         s, self._data = self.client.get(self.endpoint)
+        self._complete = True
+        self.mark_clean()
 
-    def save(self):
+    def save(self, partial=False):
         """ Update the server with any local changes, then update the
-        local version with the returned value from the server. """
-        s, self._data = self.client.post(self.endpoint, self._data,
-                                         files=self._files)
+        local version with the returned value from the server. If the
+        resource has not been modified, no request is sent.
+
+        :param partial: (optional) only send the fields and properties
+            which have been modified, as given by ``changes``, instead of
+            the full resource. If the resource was modified in a way which
+            isn't tracked (i.e. a nested value was changed), the full
+            resource is sent.
+
+        :returns: ``True`` if the resource was written to the server,
+            ``False`` if it was unchanged.
+        """
+        if partial and (self._changed or self._changed_properties or
+                        self._files):
+            data = self.changes
+        elif partial and (self._digest is None or
+                          self._hash() == self._digest):
+            return False
+        elif self.is_dirty:
+            data = self._data
+        else:
+            return False
+        s, self._data = self.client.post(self.endpoint, data,
+                                         files=self._files or {})
         # clear files so that they aren't re-uploaded
-        self._files = {}
+        self._files = None
+        self._complete = True
+        self.mark_clean()
+        return True
 
     def set_file_property(self, name, file, source_url):
-        self.properties[name] = {
+        self.update_properties({name: {
             'name': name,
             'source_url': source_url,
             'active': True
-        }
-        self._files[name] = (os.path.basename(file.name), file,
-                             mimetypes.guess_type(file.name, strict=False)[0],
-                             {'Expires': '0'})
+        }})
+        self.add_files({name: (os.path.basename(file.name), file,
+                               mimetypes.guess_type(file.name,
+                                                    strict=False)[0],
+                               {'Expires': '0'})})
+
+    def add_files(self, files):
+        """ Queue files to be uploaded with the next :meth:`save`.
+
+        :param files: a dictionary of property names and file tuples, as
+            accepted by ``requests``.
+        """
+        if self._files is None:
+            self._files = {}
+        self._files.update(files)
 
     def __repr__(self):
         return '<%s(%s)>' % (self.__class__.__name__, self[self.resource_key])
@@ -75,11 +272,30 @@ class Query(GranoObject):
     """ A query is a mechanism to store query state and paginate
     through result sets returned by the server. """
 
-    def __init__(self, client, clazz, endpoint, params=None):
+    def __init__(self, client, clazz, endpoint, params=None,
+                 streaming=False, hydrate_workers=0, result_type='resource'):
         super(Query, self).__init__(client, None)
+        if result_type not in RESULT_TYPES:
+            raise ValueError('Invalid result type: %r' % result_type)
         self.clazz = clazz
         self.endpoint = endpoint
         self.params = params or {}
+        self.streaming = streaming
+        self.hydrate_workers = hydrate_workers
+        self.result_type = result_type
+
+    def _options(self):
+        return {
+            'streaming': self.streaming,
+            'hydrate_workers': self.hydrate_workers,
+            'result_type': self.result_type
+        }
+
+    def _derive(self, endpoint, params=None, **options):
+        kwargs = self._options()
+        kwargs.update(options)
+        return self.__class__(self.client, self.clazz, endpoint,
+                              params=params, **kwargs)
 
     def reload(self):
         """ Reload the results of the query. """
@@ -99,14 +315,85 @@ class Query(GranoObject):
         """
         params = self.params.copy()
         params[name] = value
-        return self.__class__(self.client, self.clazz, self.endpoint,
-                              params=params)
+        return self._derive(self.endpoint, params=params)
+
+    def stream(self):
+        """ Return a version of the query which decodes its results from
+        the response as they arrive, rather than loading the complete page
+        first. This reduces memory use and the time to the first result for
+        large pages. ``total`` and ``next`` become available once the
+        results have been consumed. """
+        return self._derive(self.endpoint, params=self.params,
+                            streaming=True)
+
+    def hydrate(self, workers=4):
+        """ Return a version of the query which loads the full
+        representation of all results on a page as soon as a field missing
+        from the shortened representation of one of them is accessed. The
+        results are loaded in parallel, by ``workers`` threads. By default,
+        only the result which is accessed is loaded. """
+        return self._derive(self.endpoint, params=self.params,
+                            hydrate_workers=workers)
+
+    def dicts(self):
+        """ Return a version of the query which yields the results as
+        plain dictionaries, as returned by the server. This is the cheapest
+        way to scan through large result sets which are not modified. """
+        return self._derive(self.endpoint, params=self.params,
+                            result_type='dict')
+
+    def records(self):
+        """ Return a version of the query which yields the results as
+        read-only named tuples, with one field per top-level key of the
+        result. Fields which are not valid identifiers are renamed to
+        ``_<position>``. """
+        return self._derive(self.endpoint, params=self.params,
+                            result_type='record')
 
     @property
     def results(self):
-        """ The current page's results. """
-        for res in self.data.get('results'):
-            yield self.clazz(self.client, res)
+        """ The current page's results. Results are usually shortened
+        representations of the resources; the full version is loaded when
+        a missing field is accessed. See :meth:`dicts` and :meth:`records`
+        for lighter alternatives to resource objects. """
+        if self.streaming and (self._data is None or
+                               'results' not in self._data):
+            results = self._stream()
+        else:
+            results = self.data.get('results')
+        if self.result_type == 'dict':
+            return iter(results)
+        if self.result_type == 'record':
+            return (_record(self.clazz, res) for res in results)
+        return self._materialize(results)
+
+    def _materialize(self, results):
+        if self.hydrate_workers < 2:
+            return (materialize(self.client, self.clazz, res)
+                    for res in results)
+        siblings = _Siblings(self.hydrate_workers)
+        if not isinstance(results, list):
+            # Streamed results are registered as they are decoded.
+            return self._register(siblings, results)
+        # The whole page has been decoded, so all of its results are
+        # registered before the first one is used.
+        objs = [materialize(self.client, self.clazz, res) for res in results]
+        for obj in objs:
+            siblings.add(obj)
+        return iter(objs)
+
+    def _register(self, siblings, results):
+        for res in results:
+            obj = materialize(self.client, self.clazz, res)
+            siblings.add(obj)
+            yield obj
+
+    def _stream(self):
+        meta = {}
+        s, chunks = self.client.stream(self.endpoint, params=self.params)
+        for res in iter_array(chunks, meta, key='results'):
+            yield res
+        self._data = meta
 
     def __iter__(self):
         return self.results
@@ -137,14 +424,12 @@ class Query(GranoObject):
     @property
     def next(self):
         """ Return a derived query for the next page of elements. """
-        return self.__class__(self.client, self.clazz,
-                              self.data.get('next_url'))
+        return self._derive(self.data.get('next_url'))
 
     @property
     def prev(self):
         """ Return a derived query for the previous page of elements. """
-        return self.__class__(self.client, self.clazz,
-                              self.data.get('next_url'))
+        return self._derive(self.data.get('next_url'))
 
     def __len__(self):
         return self.total
@@ -154,6 +439,11 @@ class GranoCollection(GranoObject):
     """ A REST collection provided by the grano API. """
 
     query_clazz = Query
+    prefetch = 0
+    hydrate_workers = 0
+    # Set to 'dict' or 'record' to iterate over the collection without
+    # creating resource objects; see ``Query.dicts``.
+    result_type = 'resource'
 
     def __init__(self, client, params={}):
         super(GranoCollection, self).__init__(client, None)
@@ -165,23 +455,119 @@ class GranoCollection(GranoObject):
         if params is None:
             params = {}
         params.update(self.params)
-        return self.query_clazz(self.client, self.clazz, self.endpoint, params=params)
+        return self.query_clazz(self.client, self.clazz, self.endpoint,
+                                params=params,
+                                hydrate_workers=self.hydrate_workers,
+                                result_type=self.result_type)
 
-    def all(self):
+    def all(self, prefetch=None):
         """ Iterate over all available resources in the collection.
         This can also be done by just iterating over the collection::
 
             for resource in collection:
                 ...
+
+        :param prefetch: (optional) the number of pages to load in the
+            background while the current page is being consumed. Defaults
+            to the ``prefetch`` attribute of the collection, which is ``0``
+            (i.e. pages are loaded on demand).
         """
-        query = self.query()
-        while True:
+        if prefetch is None:
+            prefetch = self.prefetch
+        pages = _pages(self.query())
+        if prefetch > 0:
+            pages = _prefetch(pages, prefetch)
+        for query in pages:
             for resource in query.results:
                 yield resource
 
-            if not query.has_next:
-                break
-            query = query.next
+    def export(self, workers=4, page_size=100, retries=3):
+        """ Iterate over all resources in the collection by fetching it in
+        parallel. The result set is split into shards by offset, which are
+        loaded by ``workers`` threads. The resources are yielded in the same
+        order as by :meth:`all`; failed shards are retried individually.
+
+        The size of the shards is the number of results on the first page,
+        which may be less than ``page_size`` if the server limits it. If a
+        shard comes back with fewer results than expected (e.g. because
+        resources were deleted during the export), a
+        :class:`granoclient.GranoException` is raised, rather than silently
+        returning an incomplete result set.
+
+        :param workers: (optional) the number of parallel requests.
+        :param page_size: (optional) the number of resources per shard.
+        :param retries: (optional) how often to retry a failed shard before
+            giving up.
+        """
+        return self._export(workers, page_size, retries, {})
+
+    def _export(self, workers, page_size, retries, meta):
+        # ``meta`` receives the total reported by the server, so callers
+        # can check that they have seen the complete collection.
+        first = self.query().limit(page_size)
+        results = list(first.results)
+        total = meta['total'] = first.total
+        for resource in results:
+            yield resource
+        if total is None:
+            # Without a total, shards can't be computed; follow the links.
+            if first.has_next:
+                for query in _pages(first.next):
+                    for resource in query.results:
+                        yield resource
+            return
+        stride = len(results)
+        if stride >= total:
+            return
+        if not stride:
+            raise GranoException('Export of %r is incomplete: the server '
+                                 'returned no results of %d.' % (self, total))
+
+        def fetch(offset):
+            shard = self._fetch_shard(offset, stride, retries)
+            expected = min(stride, total - offset)
+            if len(shard) < expected:
+                raise GranoException('Export of %r is incomplete: expected '
+                                     '%d results at offset %d, got %d.' %
+                                     (self, expected, offset, len(shard)))
+            return shard
+
+        pool = WorkerPool(workers)
+        try:
+            for shard in pool.imap(fetch, range(stride, total, stride)):
+                for resource in shard:
+                    yield resource
+        finally:
+            pool.shutdown()
+
+    def _fetch_shard(self, offset, limit, retries):
+        attempt = 0
+        while True:
+            query = self.query().limit(limit).offset(offset)
+            try:
+                return list(query.results)
+            except InvalidRequest:
+                raise
+            except Exception as exc:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                log.warning('Failed to fetch %r at offset %s (%r), retrying.',
+                            self, offset, exc)
+                time.sleep(0.5 * 2 ** attempt)
+
+    def dump(self, fh, **kwargs):
+        """ Write all resources in the collection to a file as JSON, one
+        resource per line. Accepts the same arguments as :meth:`export`. """
+        for resource in self.export(**kwargs):
+            fh.write(json.dumps(_raw(resource)))
+            fh.write('\n')
+
+    def _submit(self, func, *args):
+        if not hasattr(self.client, 'pool'):
+            raise GranoException('Background requests require an '
+                                 'AsyncGrano client.')
+        return self.client.pool.submit(func, *args)
 
     def _create(self, data):
         if 'files' in data:
@@ -191,10 +577,180 @@ class GranoCollection(GranoObject):
             files = {}
 
         s, data = self.client.post(self.endpoint, data=data, files=files)
-        return self.clazz(self.client, data)
+        return materialize(self.client, self.clazz, data, complete=True)
+
+    def _identity(self, key):
+        # The live object for a resource key, if it has been fully loaded.
+        obj = self.client.identities.get((self.clazz, unicode(key)))
+        if obj is not None and obj._complete:
+            return obj
 
     def __iter__(self):
         return self.all()
 
     def __repr__(self):
         return '<%s(%s)>' % (self.__class__.__name__, self.endpoint)
+
+
+class _Siblings(object):
+    """ The partial resources which were loaded as part of the same page
+    of query results, so they can be hydrated together. """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.members = []
+        self.lock = threading.Lock()
+
+    def add(self, obj):
+        if isinstance(obj, GranoResource) and not obj._complete:
+            obj._siblings = self
+            self.members.append(weakref.ref(obj))
+
+    def hydrate(self, obj):
+        with self.lock:
+            members = [ref() for ref in self.members]
+            self.members = []
+        partial = [m for m in members if m is not None and not m._complete
+                   and m is not obj]
+        if not len(partial):
+            return obj.reload()
+        pool = WorkerPool(min(self.workers, len(partial) + 1))
+        try:
+            task = pool.submit(obj.reload)
+            for member in partial:
+                pool.submit(member.reload)
+            task.get()
+        finally:
+            pool.shutdown()
+
+
+def materialize(client, clazz, data, complete=False):
+    """ Make a resource object from its server representation. For types
+    which are ``identity_mapped``, only one live object exists for each
+    resource per client: if there already is one, it is updated in place
+    and returned instead of creating a copy. Shortened representations are
+    only merged into objects which are themselves partial and have no
+    unsaved changes; unsaved changes are kept on top of a full one.
+
+    :param complete: whether ``data`` is the full representation of the
+        resource (rather than a shortened one, as in query results).
+    """
+    pending = False
+    if not getattr(clazz, 'identity_mapped', False) or \
+            not isinstance(data, dict) or clazz.resource_key not in data:
+        obj = clazz(client, data)
+    else:
+        key = (clazz, unicode(data[clazz.resource_key]))
+        with client.identities_lock:
+            obj = client.identities.get(key)
+            if obj is None:
+                obj = clazz(client, data)
+                client.identities[key] = obj
+            elif complete:
+                # Unsaved changes are kept on top of the server's version,
+                # and the object stays dirty.
+                pending = obj._pending()
+                obj._data = _rebase(obj, data) if pending else data
+            elif not obj._complete and not obj._pending():
+                # Shortened data only fills in partial objects; it must
+                # not replace a full representation or unsaved changes.
+                obj._data.update(data)
+    if complete:
+        obj._complete = True
+        if not pending:
+            obj.mark_clean()
+    return obj
+
+
+def _rebase(obj, data):
+    # The server representation of a resource, with the fields and
+    # properties changed locally applied on top.
+    old = obj._data or {}
+    if not obj._changed and not obj._changed_properties:
+        # Changes made to nested values can't be told apart from the
+        # server's version; only pending files are kept separately.
+        return data if obj._files else old
+    data = dict(data)
+    for name in obj._changed or ():
+        if name in old:
+            data[name] = old[name]
+    if obj._changed_properties and 'properties' in old:
+        properties = dict(data.get('properties') or {})
+        for name in obj._changed_properties:
+            if name in old['properties']:
+                properties[name] = old['properties'][name]
+        data['properties'] = properties
+    return data
+
+
+_record_types = {}
+
+
+def _record(clazz, data):
+    # Named tuple types are shared by all results with the same keys.
+    if not isinstance(data, dict):
+        return data
+    keys = tuple(sorted(data.keys()))
+    name = clazz.__name__ if isinstance(clazz, type) else 'Resource'
+    record_type = _record_types.get((name, keys))
+    if record_type is None:
+        record_type = namedtuple(name + 'Record', keys, rename=True)
+        _record_types[(name, keys)] = record_type
+    return record_type(*[data[k] for k in keys])
+
+
+def _raw(result):
+    # The server representation of a result of any ``result_type``.
+    if isinstance(result, GranoObject):
+        return result._data
+    if isinstance(result, tuple):
+        return result._asdict()
+    return result
+
+
+def _pages(query):
+    while True:
+        yield query
+        if not query.has_next:
+            break
+        query = query.next
+
+
+def _prefetch(pages, depth):
+    """ Load pages on a background thread, keeping at most ``depth`` of them
+    queued ahead of the consumer. """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return
+            except Full:
+                pass
+
+    def load():
+        try:
+            for query in pages:
+                if stop.is_set():
+                    return
+                query.data
+                put(query)
+            put(None)
+        except Exception as exc:
+            put(exc)
+
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            query = queue.get()
+            if query is None:
+                return
+            if isinstance(query, Exception):
+                raise query
+            yield query
+    finally:
+        stop.set()
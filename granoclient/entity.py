@@ -1,4 +1,4 @@
-from granoclient.common import GranoResource, GranoCollection
+from granoclient.common import GranoResource, GranoCollection, materialize
 from granoclient.schema import Schema
 
 
@@ -8,6 +8,10 @@ class Entity(GranoResource):
     relations.. """
 
     resource_key = 'id'
+    identity_mapped = True
+    required_fields = ('schema', 'project')
+
+    __slots__ = ()
 
     @property
     def endpoint(self):
@@ -17,7 +21,7 @@ class Entity(GranoResource):
     def project(self):
         """ The :class:`granoclient.Project` to which this entity belongs. """
         from granoclient.project import Project
-        return Project(self.client, self['project'])
+        return materialize(self.client, Project, self['project'])
 
     @property
     def schema(self):
@@ -42,6 +46,15 @@ class Entity(GranoResource):
         from granoclient.relation import RelationCollection
         return RelationCollection(self.client, params={'source': self.id})
 
+    def traverse(self, depth=1, **kwargs):
+        """ Traverse the neighbourhood of this entity, breadth-first. See
+        :class:`granoclient.Traversal` for the available options.
+
+        :param depth: (optional) the number of hops to follow.
+        """
+        from granoclient.graph import Traversal
+        return Traversal([self], depth=depth, **kwargs)
+
 
 class EntityCollection(GranoCollection):
     """ Represents all the :class:`granoclient.Entity` currently available
@@ -54,12 +67,28 @@ class EntityCollection(GranoCollection):
 
     def by_id(self, id):
         """ Load an entity based on its id, i.e. its unique designation.
+        If the entity has already been loaded by this client, the existing
+        object is returned; call its ``reload()`` method to update it.
+
+        :param id: the id of the entity to be retrieved.
+
+        """
+        entity = self._identity(id)
+        if entity is None:
+            status, data = self.client.get(self.endpoint + '/%s' % id)
+            entity = materialize(self.client, self.clazz, data,
+                                 complete=True)
+        return entity
+
+    def by_id_async(self, id):
+        """ Load a entity based on its id in the background. This requires
+        an :class:`granoclient.AsyncGrano` client.
 
         :param id: the id of the entity to be retrieved.
 
+        :returns: a task; call its ``get()`` method to get the entity.
         """
-        status, data = self.client.get(self.endpoint + '/%s' % id)
-        return self.clazz(self.client, data)
+        return self._submit(self.by_id, id)
 
     def create(self, data):
         """ Create a new entity.
@@ -0,0 +1,177 @@
+import logging
+from Queue import Queue
+from threading import Event
+from collections import OrderedDict
+
+from granoclient.common import _pages
+from granoclient.pool import WorkerPool
+
+
+log = logging.getLogger(__name__)
+
+DIRECTIONS = {
+    'outbound': (('source', 'target'),),
+    'inbound': (('target', 'source'),),
+    'both': (('source', 'target'), ('target', 'source'))
+}
+
+
+class Traversal(object):
+    """ A breadth-first traversal of the graph around a set of seed
+    entities, e.g. to collect their k-hop neighbourhood::
+
+        traversal = Traversal([entity], depth=2, schemata=['knows'])
+        for relation in traversal:
+            print relation.source.id, relation.target.id
+
+    The frontier is expanded level by level; the relations of all entities
+    on a level are requested in parallel, and each relation is yielded as
+    soon as the page it is on has been received, in the order in which the
+    pages arrive. Once ``max_edges`` has been reached (or iteration is
+    stopped), no further pages are requested. Each entity is expanded
+    and each relation is yielded at most once. Once a traversal has been
+    run, ``nodes`` maps the ids of all entities reached to the number of
+    hops from the nearest seed.
+
+    :param seeds: the :class:`granoclient.Entity` objects to start from.
+    :param depth: (optional) the number of hops to follow.
+    :param schemata: (optional) the names of the relation schemata to
+        follow; other relations are ignored.
+    :param direction: (optional) ``outbound``, ``inbound`` or ``both``.
+    :param max_nodes: (optional) the maximum number of entities to reach,
+        including the seeds.
+    :param max_edges: (optional) the maximum number of relations to yield.
+    :param workers: (optional) the number of parallel requests.
+    :param page_size: (optional) the number of relations to request per
+        page.
+    """
+
+    def __init__(self, seeds, depth=1, schemata=None, direction='both',
+                 max_nodes=None, max_edges=None, workers=4, page_size=100):
+        if direction not in DIRECTIONS:
+            raise ValueError('Invalid direction: %r' % direction)
+        self.seeds = list(seeds)
+        self.depth = depth
+        self.schemata = set(schemata) if schemata is not None else None
+        self.direction = direction
+        self.max_nodes = max_nodes
+        self.max_edges = max_edges
+        self.workers = workers
+        self.page_size = page_size
+        self.nodes = OrderedDict()
+        self.edges = set()
+        # Set once the node or edge budget has been reached, i.e. when the
+        # traversal may be incomplete.
+        self.truncated = False
+
+    def __iter__(self):
+        self.nodes.clear()
+        self.edges.clear()
+        self.truncated = False
+        if not len(self.seeds):
+            return
+        client = self.seeds[0].client
+        frontier = []
+        for seed in self.seeds:
+            if seed.id not in self.nodes:
+                self.nodes[seed.id] = 0
+                frontier.append(seed.id)
+        pool = WorkerPool(self.workers)
+        try:
+            for level in range(1, self.depth + 1):
+                if not len(frontier) or self._exhausted:
+                    break
+                log.debug("Expanding %d entities at level %d",
+                          len(frontier), level)
+                reached = []
+                for relation in self._expand(client, pool, frontier, level,
+                                             reached):
+                    yield relation
+                frontier = reached
+        finally:
+            pool.shutdown()
+
+    def _expand(self, client, pool, frontier, level, reached):
+        """ Request the relations of all entities on the frontier, and
+        yield those to follow. Entities reached for the first time are
+        added to ``reached``. """
+        jobs = [(entity_id, near, far) for entity_id in frontier
+                for (near, far) in DIRECTIONS[self.direction]]
+        # Workers put each page on the queue as it is received, followed by
+        # ``None`` once a job is done; the stop event cancels the remaining
+        # pages and jobs.
+        pages, stop = Queue(), Event()
+        for job in jobs:
+            pool.submit(self._fetch, client, pages, stop, *job)
+        try:
+            done = 0
+            while done < len(jobs):
+                item = pages.get()
+                if item is None:
+                    done += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                far, relations = item
+                for relation in relations:
+                    if not self._accept(relation):
+                        continue
+                    other = _entity_id(relation.get(far))
+                    if other not in self.nodes:
+                        if self.max_nodes is not None and \
+                                len(self.nodes) >= self.max_nodes:
+                            self.truncated = True
+                            continue
+                        self.nodes[other] = level
+                        reached.append(other)
+                    self.edges.add(relation.id)
+                    yield relation
+                    if self._exhausted:
+                        return
+        finally:
+            stop.set()
+
+    @property
+    def _exhausted(self):
+        if self.max_edges is not None and len(self.edges) >= self.max_edges:
+            self.truncated = True
+            return True
+        return False
+
+    def _fetch(self, client, pages, stop, entity_id, near, far):
+        from granoclient.relation import RelationCollection
+        params = {near: entity_id, 'limit': self.page_size}
+        collection = RelationCollection(client, params=params)
+        try:
+            for query in _pages(collection.query()):
+                if stop.is_set():
+                    break
+                pages.put((far, list(query.results)))
+        except Exception as exc:
+            pages.put(exc)
+        finally:
+            pages.put(None)
+
+    def _accept(self, relation):
+        if relation.id in self.edges:
+            return False
+        if self.schemata is not None and \
+                _schema_name(relation.get('schema')) not in self.schemata:
+            return False
+        return True
+
+    def __repr__(self):
+        return '<Traversal(%d seeds, depth=%d, %d nodes, %d edges)>' % \
+            (len(self.seeds), self.depth, len(self.nodes), len(self.edges))
+
+
+def _entity_id(value):
+    if isinstance(value, dict):
+        return value.get('id')
+    return getattr(value, 'id', value)
+
+
+def _schema_name(value):
+    if isinstance(value, dict):
+        return value.get('name')
+    return getattr(value, 'name', value)
@@ -0,0 +1,87 @@
+import json
+import sqlite3
+from threading import Lock
+
+
+class IdentityIndex(object):
+    """ A persistent index of the records created or updated by a
+    :class:`granoclient.loader.Loader`, stored in an SQLite database.
+    It maps the signature of an entity or relation loader to the id of the
+    record on the server, and a digest of the data last written to it. This
+    means a repeated import only needs to contact the server for records
+    which are new or have changed.
+
+    :param path: the file name of the database; it will be created if it
+        does not exist yet.
+    :param commit_every: (optional) the number of changes after which they
+        are committed to disk.
+    """
+
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self._lock = Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS identities '
+                           '(kind TEXT, key TEXT, id TEXT, digest TEXT, '
+                           'PRIMARY KEY (kind, key))')
+        self._conn.commit()
+
+    def _key(self, signature):
+        return json.dumps(signature)
+
+    def get(self, kind, signature):
+        """ Get the ``(id, digest)`` stored for the given signature, or
+        ``None`` if the record is unknown. """
+        with self._lock:
+            cur = self._conn.execute('SELECT id, digest FROM identities '
+                                     'WHERE kind = ? AND key = ?',
+                                     (kind, self._key(signature)))
+            row = cur.fetchone()
+        if row is not None:
+            return row[0], row[1]
+
+    def set(self, kind, signature, id, digest):
+        """ Store the id of a record and the digest of its data. """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO identities '
+                               '(kind, key, id, digest) VALUES (?, ?, ?, ?)',
+                               (kind, self._key(signature), unicode(id),
+                                digest))
+            self._changed()
+
+    def remove(self, kind, signature):
+        """ Remove a record, e.g. because it no longer exists on the
+        server. """
+        with self._lock:
+            self._conn.execute('DELETE FROM identities WHERE kind = ? '
+                               'AND key = ?', (kind, self._key(signature)))
+            self._changed()
+
+    def _changed(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def flush(self):
+        """ Commit all changes to disk. """
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            cur = self._conn.execute('SELECT COUNT(*) FROM identities')
+            return cur.fetchone()[0]
+
+    def __repr__(self):
+        return '<IdentityIndex(%s)>' % self.path
@@ -0,0 +1,108 @@
+import time
+import threading
+
+
+class RateLimiter(object):
+    """ Limits the load a client puts on the grano server. Requests must
+    obtain a token from a token bucket, which caps the request rate, and a
+    slot within a concurrency limit. The concurrency limit adapts to the
+    server's behaviour (additive increase, multiplicative decrease): it
+    grows slowly while requests succeed, and is cut back as soon as the
+    server responds with 429 or 5xx errors, fails to respond, or takes
+    longer than ``target_latency``.
+
+    A single limiter can be shared by several :class:`granoclient.Grano`
+    instances, so that all of them together stay within the limits::
+
+        limiter = RateLimiter(rate=50, max_concurrency=20)
+        a = Grano(limiter=limiter)
+        b = Grano(limiter=limiter)
+
+    :param rate: (optional) the maximum number of requests per second.
+    :param burst: (optional) the number of requests which may be sent at
+        once after an idle period. Defaults to ``rate``.
+    :param concurrency: (optional) the initial number of parallel requests.
+    :param min_concurrency: (optional) the lower bound for the adaptive
+        concurrency limit.
+    :param max_concurrency: (optional) the upper bound for the adaptive
+        concurrency limit.
+    :param target_latency: (optional) a response time, in seconds, above
+        which the server is considered overloaded.
+    :param decrease: (optional) the factor applied to the concurrency limit
+        when the server is overloaded.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=4,
+                 min_concurrency=1, max_concurrency=64, target_latency=None,
+                 decrease=0.5):
+        self.rate = rate
+        self.burst = burst or rate or 1
+        self.limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.active = 0
+        self.throttled = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.time()
+        self._decreased = 0
+        self._bucket = threading.Lock()
+        self._slots = threading.Condition()
+
+    def _take_token(self):
+        if not self.rate:
+            return
+        with self._bucket:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._refilled) * self.rate)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            # Waiting while holding the lock makes later callers queue up
+            # behind this one, which spaces out the requests evenly.
+            wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            self._tokens = 0.0
+            self._refilled = now + wait
+
+    def acquire(self):
+        """ Block until a request may be sent. """
+        with self._slots:
+            if self.active >= int(self.limit):
+                self.throttled += 1
+            while self.active >= int(self.limit):
+                self._slots.wait()
+            self.active += 1
+        self._take_token()
+
+    def release(self, latency, status=None):
+        """ Mark a request as completed and adapt the concurrency limit.
+
+        :param latency: the time the request took, in seconds.
+        :param status: the HTTP status code of the response, or ``None``
+            if the request failed.
+        """
+        now = time.time()
+        overloaded = status is None or status == 429 or status >= 500 or \
+            (self.target_latency is not None and
+             latency > self.target_latency)
+        with self._slots:
+            self.active -= 1
+            if overloaded:
+                # Requests which were already in flight when the server got
+                # overloaded report it too; only react once per round trip.
+                if now - self._decreased > latency:
+                    self.limit = max(self.min_concurrency,
+                                     self.limit * self.decrease)
+                    self._decreased = now
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            self._slots.notify_all()
+
+    def __repr__(self):
+        return '<RateLimiter(rate=%s, concurrency=%.1f)>' % (self.rate,
+                                                              self.limit)
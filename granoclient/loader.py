@@ -1,14 +1,30 @@
 import os
+import json
+import time
+import hashlib
 import logging
+import heapq
 import mimetypes
-from threading import RLock
+from threading import RLock, Lock
+from contextlib import contextmanager
+from collections import OrderedDict, Counter, defaultdict
 
-from granoclient.base import InvalidRequest
+from granoclient.base import GranoException, InvalidRequest, NotFound
+from granoclient.cache import LRUCache
+from granoclient.common import materialize
+from granoclient.index import IdentityIndex
+from granoclient.metrics import Histogram
+from granoclient.pool import WorkerPool
 
 
 log = logging.getLogger(__name__)
 
 
+class UnsavedEndpoint(GranoException):
+    """ Raised when a relation refers to an entity which could not be
+    saved, rather than sending the entity again for each relation. """
+
+
 class ObjectLoader(object):
     # Abstract parent
 
@@ -18,6 +34,15 @@ class ObjectLoader(object):
         self.properties = {}
         self.update_criteria = set()
         self.files = {}
+        self._task = None
+        # Whether the record was resolved to an unverified stub from the
+        # identity index, see ``_save_indexed``.
+        self._stub = False
+        # The exception which made the last save fail, if any.
+        self._failure = None
+        # Matches found by a lookup run ahead of the save, see
+        # ``Loader._resolve``.
+        self._found = None
 
     def unique(self, name, only_active=True):
         """ Define a unique field for this entity or relation. Each unique
@@ -62,19 +87,141 @@ class ObjectLoader(object):
     def lock(self):
         sig = self.signature
         if sig not in self.loader.locks:
-            self.loader.locks[sig] = RLock()
+            self.loader.locks.setdefault(sig, RLock())
         return self.loader.locks[sig]
 
+    @contextmanager
+    def _saving(self):
+        # Hold the lock for the record while it is being saved, reporting
+        # the time spent waiting for the lock and saving the record.
+        report = self.loader.report
+        start = time.time()
+        with self.lock():
+            acquired = time.time()
+            report.waited(acquired - start)
+            try:
+                yield
+            finally:
+                report.done(self, time.time() - acquired)
+
+    @property
+    def batch_key(self):
+        """ A key identifying loaders that describe the same record, used
+        to collapse duplicates within a chunk of a buffered loader. """
+        return (self.schema, tuple(sorted(self.update_criteria)),
+                self.signature)
+
+    def absorb(self, other):
+        """ Merge the properties and files of another loader for the same
+        record into this one. Values set on ``other`` take precedence. """
+        self.properties.update(other.properties)
+        self.files.update(other.files)
+
+    def save(self):
+        """ Save the object to the database. Do this only once, after all
+        properties have been set. If the loader is buffered, the object will
+        be queued and written when the next chunk is flushed. If the loader
+        has workers, the object will be written on a background thread. """
+        if self.loader.buffered:
+            self.loader.enqueue(self)
+        elif self.loader.workers:
+            self._task = self.loader.pool.submit(self._run)
+        else:
+            self._save()
+
+    def _run(self):
+        try:
+            self._save()
+        except Exception, exc:
+            log.exception(exc)
+            self._failure = exc
+            self.loader.report.failed(self, exc)
+
+    def wait(self):
+        """ Block until a save running on a worker thread has completed. If
+        no worker has started it yet, it is run on the current thread, so
+        that a worker never waits for a task queued behind its own. """
+        if self._task is not None:
+            self._task.run_or_wait()
+
+    @property
+    def digest(self):
+        """ A hash of the data this loader writes to the server. """
+        data = json.dumps({'schema': self.schema,
+                           'properties': self.properties}, sort_keys=True)
+        return hashlib.sha1(data).hexdigest()
+
+    def _needs_lookup(self):
+        # Records held in the cache or the identity index are resolved
+        # without a lookup query.
+        if self.loader.cache is not None and \
+                self.signature in self.loader.cache:
+            return False
+        return self.loader.index is None or \
+            self.loader.index.get(self.kind, self.signature) is None
+
+    @property
+    def _generation(self):
+        return self.loader._generations.get((self.kind, self.signature), 0)
+
+    def _matches(self):
+        # Use the result of a lookup run ahead of the save, unless the
+        # record has been saved (e.g. by another chunk) since.
+        found, self._found = self._found, None
+        if found is None or found[0] != self._generation:
+            return self._lookup()
+        return found[1]
+
+    def _save_indexed(self):
+        # Resolve the record through the loader's identity index, if it has
+        # been written by an earlier run. Unchanged records are not fetched
+        # at all; a stub with only the id is returned instead.
+        index = self.loader.index
+        if index is None:
+            return None
+        entry = index.get(self.kind, self.signature)
+        if entry is None:
+            return None
+        obj_id, digest = entry
+        try:
+            if len(self.files) or digest != self.digest:
+                with self.loader.report.timed('lookup'):
+                    obj = self.collection.by_id(obj_id)
+                self._update(obj)
+            else:
+                obj = materialize(self.loader.project.client,
+                                  self.collection.clazz, {'id': obj_id})
+                self._stub = True
+                self.loader.report.count(self, 'unchanged')
+        except NotFound:
+            index.remove(self.kind, self.signature)
+            return None
+        return obj
+
+    def _remember(self, obj):
+        # Called with the record's lock held, see ``_saving``.
+        key = (self.kind, self.signature)
+        self.loader._generations[key] = \
+            self.loader._generations.get(key, 0) + 1
+        if self.loader.index is not None:
+            self.loader.index.set(self.kind, self.signature, obj.id,
+                                  self.digest)
+
 
 class EntityLoader(ObjectLoader):
     """ A factory object for entities, used to set the schemata and
     properties for an entity. """
 
+    kind = 'entity'
+
     def __init__(self, loader, schema, source_url=None):
         self._setup(loader, schema)
         self.unique('name', only_active=False)
         self.source_url = source_url
         self._entity = None
+        # Whether the entity was created by this loader, in which case it
+        # can't have any relations yet.
+        self.created = False
 
     @property
     def signature(self):
@@ -85,47 +232,124 @@ class EntityLoader(ObjectLoader):
 
     @property
     def entity(self):
+        # An entity whose save failed is not sent again; the relations
+        # referring to it fail instead.
+        if self._entity is None:
+            self.wait()
+        if self._entity is None and self._failure is None:
+            self.loader.flush()
+        if self._entity is None and self._failure is None:
+            self._save()
         if self._entity is None:
-            self.save()
+            raise UnsavedEndpoint('Entity %r was not saved: %r' %
+                                  (self.signature, self._failure))
         return self._entity
 
-    def save(self):
-        """ Save the entity to the database. Do this only once, after all
-        properties have been set. """
-
-        with self.lock():
-            q = self.loader.project.entities.query()
-            for name, only_active in self.update_criteria:
-                value = self.properties.get(name).get('value')
-                key = 'property-'
-                if not only_active:
-                    key = key + 'aliases-'
-                q = q.filter(key + name, value)
-
+    @property
+    def collection(self):
+        return self.loader.project.entities
+
+    def _update(self, entity):
+        if not len(self.files) and \
+                _unchanged(entity['properties'], self.properties):
+            self.loader.report.count(self, 'unchanged')
+            return
+        entity.update_properties(self.properties)
+        entity.add_files(self.files)
+        with self.loader.report.timed('write'):
+            entity.save(partial=self.loader.partial)
+        self.loader.report.count(self, 'updated')
+
+    def _save(self):
+        with self._saving():
             try:
-                entities = list(q.results)
-                if len(entities) == 0:
-                    data = {
-                        'schema': self.schema,
-                        'properties': self.properties,
-                        'files': self.files
-                    }
-                    self._entity = self.loader.project.entities.create(data)
-                else:
-                    if len(entities) > 1:
-                        log.warn("Ambiguous update: %r" % entities)
-                    self._entity = entities[0]
-                    self._entity._data['properties'].update(self.properties)
-                    self._entity._files.update(self.files)
-                    self._entity.save()
+                if self._save_cached():
+                    return
+                self._entity = self._save_indexed()
+                if self._entity is None:
+                    self._entity = self._save_lookup()
+                self._remember(self._entity)
+                self._failure = None
             except InvalidRequest, inv:
                 log.warning("Validation error: %r", inv)
+                self._failure = inv
+                self.loader.report.failed(self, inv)
+            except Exception, exc:
+                self._failure = exc
+                raise
+
+    def _lookup(self):
+        q = self.collection.query()
+        for name, only_active in self.update_criteria:
+            value = self.properties.get(name).get('value')
+            key = 'property-'
+            if not only_active:
+                key = key + 'aliases-'
+            q = q.filter(key + name, value)
+
+        with self.loader.report.timed('lookup'):
+            return list(q.results)
+
+    def _save_lookup(self):
+        entities = self._matches()
+        if len(entities) == 0:
+            data = {
+                'schema': self.schema,
+                'properties': self.properties,
+                'files': self.files
+            }
+            with self.loader.report.timed('write'):
+                entity = self.collection.create(data)
+            self.created = True
+            self.loader.report.count(self, 'created')
+            return entity
+        if len(entities) > 1:
+            log.warn("Ambiguous update: %r" % entities)
+            self.loader.report.count(self, 'ambiguous')
+        self._update(entities[0])
+        return entities[0]
+
+    def _remember(self, entity):
+        super(EntityLoader, self)._remember(entity)
+        # stubs from the identity index have no properties to compare with
+        if self.loader.cache is not None and 'properties' in entity._data:
+            self.loader.cache.set(self.signature, entity)
+
+    def _forget(self):
+        # Drop a resolved entity which turned out not to exist any more, so
+        # that the next access to ``entity`` writes it again.
+        if self.loader.index is not None:
+            self.loader.index.remove(self.kind, self.signature)
+        if self.loader.cache is not None:
+            self.loader.cache.pop(self.signature)
+        self._entity = None
+        self._stub = False
+        self.created = False
+
+    def _save_cached(self):
+        # Re-use an entity which was resolved for the same signature before,
+        # skipping the lookup query (and the update, if nothing changed).
+        if self.loader.cache is None:
+            return False
+        entity = self.loader.cache.get(self.signature)
+        if entity is None:
+            return False
+        try:
+            self._update(entity)
+        except NotFound:
+            self.loader.cache.pop(self.signature)
+            return False
+        self._remember(entity)
+        self._entity = entity
+        return True
 
 
 class RelationLoader(ObjectLoader):
     """ A factory object for relations, used to construct a relation by setting
     its schema, source entity, target entity and a set of properties. """
 
+    kind = 'relation'
+
     def __init__(self, loader, schema, source, target, source_url=None):
         self._setup(loader, schema)
         self.source_url = source_url
@@ -139,56 +363,186 @@ class RelationLoader(ObjectLoader):
             keys.append(self.properties.get(p, {}).get('value'))
         return tuple(keys)
 
-    def save(self):
-        """ Save the relation to the database. Do this only once, after all
-        properties have been set. """
-
-        with self.lock():
-            q = self.loader.project.relations.query()
-            q = q.filter('source', self.source.entity.id)
-            q = q.filter('target', self.target.entity.id)
-
-            for name, only_active in self.update_criteria:
-                value = self.properties.get(name).get('value')
-                key = 'property-'
-                if not only_active:
-                    key = key + 'aliases-'
-                q = q.filter(key + name, value)
-
+    @property
+    def collection(self):
+        return self.loader.project.relations
+
+    def _update(self, rel):
+        source, target = self.source.entity.id, self.target.entity.id
+        if not len(self.files) and \
+                _ref(rel.get('schema'), 'name') == self.schema and \
+                _ref(rel.get('source'), 'id') == source and \
+                _ref(rel.get('target'), 'id') == target and \
+                _unchanged(rel['properties'], self.properties):
+            self.loader.report.count(self, 'unchanged')
+            return
+        rel['schema'] = self.schema
+        rel['source'] = source
+        rel['target'] = target
+        rel.update_properties(self.properties)
+        rel.add_files(self.files)
+        with self.loader.report.timed('write'):
+            rel.save(partial=self.loader.partial)
+        self.loader.report.count(self, 'updated')
+
+    def _save(self):
+        with self._saving():
             try:
-                relations = list(q.results)
-                if len(relations) == 0:
-                    data = {
-                        'schema': self.schema,
-                        'source': self.source.entity.id,
-                        'target': self.target.entity.id,
-                        'properties': self.properties,
-                        'files': self.files
-                    }
-                    self.loader.project.relations.create(data)
-                else:
-                    if len(relations) > 1:
-                        log.warn("Ambiguous update: %r" % relations)
-                    rel = relations[0]
-                    rel._data['schema'] = self.schema
-                    rel._data['source'] = self.source.entity.id
-                    rel._data['target'] = self.target.entity.id
-                    rel._data['properties'].update(self.properties)
-                    rel._files.update(self.files)
-                    rel.save()
+                try:
+                    rel = self._save_indexed()
+                    if rel is None:
+                        rel = self._save_lookup()
+                except (InvalidRequest, NotFound), exc:
+                    # The source or target may have been resolved to the id
+                    # of an entity which has since been deleted; if so, it
+                    # is written again and the relation retried once.
+                    if not self._evict_stale(exc):
+                        raise
+                    self._found = None
+                    rel = self._save_lookup()
+                self._remember(rel)
             except InvalidRequest, inv:
                 log.warning("Validation error: %r", inv)
+                self.loader.report.failed(self, inv)
+            except UnsavedEndpoint, exc:
+                log.warning("%s", exc)
+                self.loader.report.failed(self, exc)
+
+    def _evict_stale(self, exc):
+        # Only stubs from the identity index are unverified; other ids are
+        # checked only if the server reported a missing object.
+        stale = False
+        for end in (self.source, self.target):
+            if end._entity is None or \
+                    not (end._stub or isinstance(exc, NotFound)):
+                continue
+            try:
+                end._entity.reload()
+            except NotFound:
+                log.info("Entity %s no longer exists, dropping it from the "
+                         "index.", end._entity.id)
+                end._forget()
+                stale = True
+        return stale
+
+    def _needs_lookup(self):
+        # Lookups are only run ahead for relations between saved entities.
+        if self.source._entity is None or self.target._entity is None:
+            return False
+        return super(RelationLoader, self)._needs_lookup()
+
+    def _lookup(self):
+        source, target = self.source.entity, self.target.entity
+        # An entity created by this loader has no relations on the server
+        # yet, so there is nothing to find unless this relation has been
+        # saved already.
+        if (self.source.created or self.target.created) and \
+                not self._generation:
+            return []
+        q = self.collection.query()
+        q = q.filter('source', source.id)
+        q = q.filter('target', target.id)
+
+        for name, only_active in self.update_criteria:
+            value = self.properties.get(name).get('value')
+            key = 'property-'
+            if not only_active:
+                key = key + 'aliases-'
+            q = q.filter(key + name, value)
+
+        with self.loader.report.timed('lookup'):
+            return list(q.results)
+
+    def _save_lookup(self):
+        relations = self._matches()
+        if len(relations) == 0:
+            data = {
+                'schema': self.schema,
+                'source': self.source.entity.id,
+                'target': self.target.entity.id,
+                'properties': self.properties,
+                'files': self.files
+            }
+            with self.loader.report.timed('write'):
+                rel = self.collection.create(data)
+            self.loader.report.count(self, 'created')
+            return rel
+        if len(relations) > 1:
+            log.warn("Ambiguous update: %r" % relations)
+            self.loader.report.count(self, 'ambiguous')
+        self._update(relations[0])
+        return relations[0]
 
 
 class Loader(object):
     """ A loader is a factory object that can be used to make entities and
     relations in the database. It will perform some validation and handle
-    database transactions. """
-
-    def __init__(self, project, source_url=None):
+    database transactions.
+
+    :param project: the :class:`granoclient.Project` to load data into.
+    :param source_url: (optional) a URL which will be made the default
+        source for all properties.
+    :param chunk_size: (optional) queue saved entities and relations, and
+        write them once this many have been collected. See :meth:`flush`.
+    :param flush_interval: (optional) queue saved entities and relations,
+        and write them when one is saved after this many seconds have
+        passed since the last flush. There is no timer: records stay in
+        the buffer until the next save, ``flush()`` or ``persist()``.
+    :param workers: (optional) the number of threads used to write
+        entities and relations in parallel.
+    :param max_pending: (optional) the number of saves which can be waiting
+        for a worker before ``save()`` blocks.
+    :param cache_size: (optional) the number of resolved entities to keep
+        by their signature, so repeated saves can skip the lookup query.
+    :param index: (optional) a :class:`granoclient.index.IdentityIndex`,
+        or the file name of one, which keeps track of written records
+        across runs.
+    :param partial: (optional) when updating existing records, only send
+        the properties set by the loader instead of the full record.
+    :param lookup_workers: (optional) the number of lookup queries of a
+        chunk which are run in parallel when it is flushed. Defaults to 4.
+    """
+
+    def __init__(self, project, source_url=None, chunk_size=None,
+                 flush_interval=None, workers=None, max_pending=None,
+                 cache_size=None, index=None, partial=False,
+                 lookup_workers=4):
         self.source_url = source_url
         self.project = project
         self.locks = {}
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.workers = workers
+        self.max_pending = max_pending
+        self.report = LoaderReport()
+        self.cache = LRUCache(cache_size) if cache_size else None
+        if isinstance(index, basestring):
+            index = IdentityIndex(index)
+        self.index = index
+        self.partial = partial
+        self.lookup_workers = lookup_workers
+        self._pool = None
+        self._buffer = []
+        self._buffer_lock = RLock()
+        # The number of times each record has been saved, used to detect
+        # lookups which were run ahead of a save and have become stale.
+        self._generations = {}
+        self._last_flush = time.time()
+
+    @property
+    def buffered(self):
+        """ Whether saved entities and relations are queued up and written
+        in chunks, rather than immediately. """
+        return self.chunk_size is not None or self.flush_interval is not None
+
+    @property
+    def pool(self):
+        """ The :class:`granoclient.pool.WorkerPool` used to save entities
+        and relations in parallel, if ``workers`` is set. """
+        if self._pool is None:
+            self._pool = WorkerPool(self.workers,
+                                    max_pending=self.max_pending)
+        return self._pool
 
     def make_entity(self, schema, source_url=None):
         """ Create an entity loader, i.e. a construction helper for entities.
@@ -223,5 +577,286 @@ class Loader(object):
                                   source_url=source_url or self.source_url)
         return relation
 
+    def enqueue(self, obj):
+        """ Add an entity or relation loader to the buffer, flushing it if
+        either the chunk size or the flush interval has been reached. This
+        is the only place where the flush interval is checked. """
+        with self._buffer_lock:
+            self._buffer.append(obj)
+            full = self.chunk_size is not None and \
+                len(self._buffer) >= self.chunk_size
+            due = self.flush_interval is not None and \
+                time.time() - self._last_flush >= self.flush_interval
+        if full or due:
+            self.flush()
+
+    def flush(self):
+        """ Write all buffered entities and relations to the server.
+        Loaders which refer to the same record (i.e. they have the same
+        schema and unique keys) are merged, so that each record is looked
+        up and written only once per chunk. The lookups of a chunk are run
+        as a batch of ``lookup_workers`` parallel queries before any of its
+        records are written; relations of entities which were created by
+        this loader are not looked up at all. Since the grano API has no
+        bulk endpoint, each record which needs to be created or updated is
+        still written with its own request. Entities are written before
+        relations, so that relations can refer to their ids. """
+        with self._buffer_lock:
+            buffer, self._buffer = self._buffer, []
+            self._last_flush = time.time()
+        if not len(buffer):
+            return
+
+        entities = [o for o in buffer if isinstance(o, EntityLoader)]
+        groups = _group(entities)
+        self._resolve(groups)
+        self._save_groups(groups)
+        for group in groups:
+            for obj in group[1:]:
+                obj._entity = group[0]._entity
+                obj._stub = group[0]._stub
+                obj._failure = group[0]._failure
+                obj.created = group[0].created
+
+        relations = [o for o in buffer if isinstance(o, RelationLoader)]
+        groups = _group(relations)
+        self._resolve(groups)
+        self._save_groups(groups)
+        log.debug('Flushed %d entities, %d relations.', len(entities),
+                  len(relations))
+
+    def _resolve(self, groups):
+        # Run the lookup queries of a chunk in parallel, ahead of the
+        # writes. A failed lookup is repeated (and reported) by the save.
+        pending = [g[0] for g in groups if g[0]._needs_lookup()]
+        if not len(pending):
+            return
+
+        def lookup(obj):
+            try:
+                generation = obj._generation
+                obj._found = (generation, obj._lookup())
+            except Exception as exc:
+                log.debug('Lookup for %r failed: %r', obj.signature, exc)
+
+        if self.lookup_workers < 2 or len(pending) < 2:
+            for obj in pending:
+                lookup(obj)
+            return
+        pool = WorkerPool(min(self.lookup_workers, len(pending)))
+        try:
+            for obj in pending:
+                pool.submit(lookup, obj)
+        finally:
+            pool.shutdown()
+
+    def _save_groups(self, groups):
+        # Without workers, or when already running on one, the groups are
+        # saved inline; waiting on the pool from a worker could deadlock.
+        # Failures are reported per group, so one bad record does not stop
+        # the rest of the buffer from being written.
+        if not self.workers or self.pool.in_worker:
+            for group in groups:
+                group[0]._run()
+            return
+        for group in groups:
+            group[0]._task = self.pool.submit(group[0]._run)
+        for group in groups:
+            group[0].wait()
+
     def persist(self):
-        """ No-op on the web. """
+        """ Flush any buffered entities and relations to the server and
+        wait for all background saves to complete.
+
+        :returns: the :class:`LoaderReport` for this run, which is also
+            available as ``report`` while the run is in progress.
+        """
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.index is not None:
+            self.index.flush()
+        return self.report
+
+
+class LoaderReport(object):
+    """ A report on the outcome of a loader run, which is updated while the
+    run is in progress. The number of records which were ``created``,
+    ``updated`` or left ``unchanged`` (i.e. no request was sent) is kept in
+    ``counts``, along with the number of ``ambiguous`` lookups (which
+    matched several records, the first of which was used) and of
+    ``rejected`` (failed validation) and ``failed`` records. The same
+    counts are kept for each schema in ``schemata``. Entities and relations
+    which could not be saved are collected as ``(loader, exception)``
+    tuples in ``failures``.
+
+    To show where the time goes, the report keeps histograms of the time
+    spent waiting for the lock on a record (``lock_wait``), on lookup
+    requests (``lookup``) and on write requests (``write``). The records
+    which took longest to save are listed in ``slowest``, and
+    :meth:`throughput` gives the number of records saved per second over
+    the course of the run.
+
+    :param interval: (optional) the length, in seconds, of the periods
+        for which the throughput is given.
+    :param keep_slowest: (optional) the number of slowest records to list.
+    """
+
+    def __init__(self, interval=10, keep_slowest=10):
+        self.interval = interval
+        self.keep_slowest = keep_slowest
+        self.started = time.time()
+        self.counts = Counter()
+        self.schemata = defaultdict(Counter)
+        self.failures = []
+        self.saved = 0
+        self.lock_wait = Histogram()
+        self.lookup = Histogram()
+        self.write = Histogram()
+        self._slowest = []
+        self._periods = Counter()
+        self._seq = 0
+        self._lock = Lock()
+
+    def count(self, obj, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.schemata[obj.schema][outcome] += 1
+
+    def failed(self, obj, exc):
+        outcome = 'rejected' if isinstance(exc, InvalidRequest) else 'failed'
+        with self._lock:
+            self.failures.append((obj, exc))
+            self.counts[outcome] += 1
+            self.schemata[obj.schema][outcome] += 1
+
+    def waited(self, duration):
+        """ Record the time spent waiting for the lock on a record. """
+        with self._lock:
+            self.lock_wait.observe(duration)
+
+    @contextmanager
+    def timed(self, operation):
+        """ Measure the time spent on a ``lookup`` or ``write`` request. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            with self._lock:
+                getattr(self, operation).observe(duration)
+
+    def done(self, obj, duration):
+        """ Record that a record has been saved, and how long it took. """
+        now = time.time()
+        with self._lock:
+            self.saved += 1
+            self._periods[int((now - self.started) / self.interval)] += 1
+            self._seq += 1
+            entry = (duration, self._seq, obj.kind, obj.schema,
+                     obj.signature)
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def written(self):
+        """ The number of records which were sent to the server. """
+        return self.counts['created'] + self.counts['updated']
+
+    @property
+    def skipped(self):
+        """ The number of writes avoided because nothing had changed. """
+        return self.counts['unchanged']
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    @property
+    def rate(self):
+        """ The average number of records saved per second. """
+        elapsed = self.elapsed
+        return self.saved / elapsed if elapsed > 0 else 0.0
+
+    def throughput(self):
+        """ The number of records saved per second, as a list of
+        ``(seconds since the start, rate)`` tuples, one for each
+        ``interval``. """
+        with self._lock:
+            periods = dict(self._periods)
+        if not len(periods):
+            return []
+        return [(round(period * self.interval, 3),
+                 periods.get(period, 0) / float(self.interval))
+                for period in range(max(periods) + 1)]
+
+    @property
+    def slowest(self):
+        """ The records which took longest to save, as ``(seconds, kind,
+        schema, signature)`` tuples, slowest first. """
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [(d, kind, schema, sig) for (d, _, kind, schema, sig)
+                in entries]
+
+    def snapshot(self):
+        """ The current state of the report as a dictionary. """
+        with self._lock:
+            data = {
+                'elapsed': self.elapsed,
+                'saved': self.saved,
+                'counts': dict(self.counts),
+                'schemata': dict((k, dict(v)) for k, v in
+                                 self.schemata.items()),
+                'failures': len(self.failures),
+                'lock_wait': self.lock_wait.to_dict(),
+                'lookup': self.lookup.to_dict(),
+                'write': self.write.to_dict()
+            }
+        data['rate'] = self.rate
+        data['throughput'] = self.throughput()
+        data['slowest'] = self.slowest
+        return data
+
+    def __repr__(self):
+        return '<LoaderReport(%d written, %d skipped, %d failures, ' \
+            '%.1f/s)>' % (self.written, self.skipped, len(self.failures),
+                          self.rate)
+
+
+def _unchanged(current, properties):
+    """ Check if applying ``properties`` to the ``current`` properties of a
+    record would leave them as they are. """
+    for name, prop in properties.items():
+        existing = current.get(name)
+        if existing is None:
+            return False
+        for key, value in prop.items():
+            if existing.get(key) != value:
+                return False
+    return True
+
+
+def _ref(value, key):
+    """ Get the identifier of a reference which may be inlined as an
+    object in the server representation of a record. """
+    if isinstance(value, dict):
+        return value.get(key)
+    return value
+
+
+def _group(loaders):
+    """ Collapse a list of loaders into groups describing the same record.
+    The first loader in each group absorbs the data of all of the others. """
+    groups = OrderedDict()
+    for obj in loaders:
+        key = obj.batch_key
+        if key in groups:
+            groups[key][0].absorb(obj)
+            groups[key].append(obj)
+        else:
+            groups[key] = [obj]
+    return groups.values()
@@ -0,0 +1,286 @@
+import time
+import logging
+from threading import Lock
+from collections import Counter
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The name of the key which follows a collection in an API path; all
+# other path segments are kept as they are.
+KEYS = {
+    'projects': '{slug}',
+    'entities': '{id}',
+    'relations': '{id}',
+    'schemata': '{name}',
+    'accounts': '{id}'
+}
+
+
+def endpoint_template(path):
+    """ Generalize an API path to the endpoint it belongs to, e.g.
+    ``/entities/4f2a`` to ``/entities/{id}``, so that requests to the same
+    endpoint can be grouped. """
+    path = path.split('?', 1)[0]
+    segments = path.strip('/').split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in KEYS:
+            segments[i] = KEYS[segments[i - 1]]
+    return '/' + '/'.join(segments)
+
+
+class Hooks(object):
+    """ Callbacks which are invoked around each HTTP request sent by a
+    :class:`granoclient.Client`::
+
+        def log_slow(method, url, response, elapsed):
+            if elapsed > 1:
+                print 'slow', method, url
+
+        grano = Grano(hooks=Hooks(after_response=log_slow))
+
+    Exceptions raised by a callback are logged and otherwise ignored.
+
+    :param before_request: (optional) called as ``(method, url, kwargs)``
+        before a request is sent; ``kwargs`` are the arguments to
+        ``requests.Session.request`` and may be modified.
+    :param after_response: (optional) called as ``(method, url, response,
+        elapsed)`` once a response has been received, including responses
+        with an error status.
+    :param on_error: (optional) called as ``(method, url, exception,
+        elapsed)`` if no response was received, e.g. after a timeout.
+    """
+
+    def __init__(self, before_request=None, after_response=None,
+                 on_error=None):
+        self.before_request = []
+        self.after_response = []
+        self.on_error = []
+        self.add(before_request=before_request,
+                 after_response=after_response, on_error=on_error)
+
+    def add(self, before_request=None, after_response=None, on_error=None):
+        """ Register further callbacks. """
+        for name, func in (('before_request', before_request),
+                           ('after_response', after_response),
+                           ('on_error', on_error)):
+            if func is not None:
+                getattr(self, name).append(func)
+
+    def fire(self, name, *args):
+        for func in getattr(self, name):
+            try:
+                func(*args)
+            except Exception as exc:
+                log.exception('Hook %r failed: %r', func, exc)
+
+
+class Histogram(object):
+    """ Counts observations in cumulative buckets, like a Prometheus
+    histogram. """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip(self.buckets, self.counts))
+        }
+
+
+class Metrics(object):
+    """ Statistics on the requests sent by a :class:`granoclient.Client`,
+    available as ``client.metrics``. Requests are grouped by HTTP method
+    and endpoint template (e.g. ``/entities/{id}``). For each group, the
+    number of requests by status, their latency, the bytes sent and
+    received and the number of retries are recorded, as well as the time
+    spent encoding and decoding JSON.
+
+    Use :meth:`snapshot` to get the current values as a dictionary, or
+    :meth:`prometheus` to export them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """ Discard all values recorded so far. """
+        with self._lock:
+            self.requests = Counter()
+            self.errors = Counter()
+            self.retries = Counter()
+            self.bytes_sent = Counter()
+            self.bytes_received = Counter()
+            self.latency = {}
+            self.json = {'encode': Histogram(), 'decode': Histogram()}
+
+    def _group(self, method, path):
+        return (method, endpoint_template(path))
+
+    def response(self, method, path, status, elapsed, sent=0, received=0):
+        """ Record a completed request.
+
+        :param method: the HTTP method.
+        :param path: the API path requested, e.g. ``/entities/4f2a``.
+        :param status: the status code of the response.
+        :param elapsed: the time the request took, in seconds.
+        :param sent: (optional) the size of the request body.
+        :param received: (optional) the size of the response body.
+        """
+        group = self._group(method, path)
+        with self._lock:
+            self.requests[group + (status,)] += 1
+            if group not in self.latency:
+                self.latency[group] = Histogram()
+            self.latency[group].observe(elapsed)
+            self.bytes_sent[group] += sent
+            self.bytes_received[group] += received
+
+    def received(self, method, path, size):
+        """ Add to the bytes received, e.g. for a streamed response. """
+        with self._lock:
+            self.bytes_received[self._group(method, path)] += size
+
+    def error(self, method, path, exc):
+        """ Record a request for which no response was received. """
+        with self._lock:
+            self.errors[self._group(method, path) +
+                        (exc.__class__.__name__,)] += 1
+
+    def retry(self, method, path):
+        with self._lock:
+            self.retries[self._group(method, path)] += 1
+
+    @contextmanager
+    def timed(self, operation):
+        """ Measure the time spent on JSON ``encode`` or ``decode``. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.json[operation].observe(elapsed)
+
+    def snapshot(self):
+        """ The current values, as a dictionary which can be serialized to
+        JSON. """
+        with self._lock:
+            endpoints = {}
+
+            def group(key):
+                name = '%s %s' % key[:2]
+                if name not in endpoints:
+                    endpoints[name] = {'requests': {}, 'errors': {},
+                                       'retries': 0, 'bytes_sent': 0,
+                                       'bytes_received': 0}
+                return endpoints[name]
+
+            for key, count in self.requests.items():
+                group(key)['requests'][str(key[2])] = count
+            for key, count in self.errors.items():
+                group(key)['errors'][key[2]] = count
+            for key, count in self.retries.items():
+                group(key)['retries'] = count
+            for key, size in self.bytes_sent.items():
+                group(key)['bytes_sent'] = size
+            for key, size in self.bytes_received.items():
+                group(key)['bytes_received'] = size
+            for key, histogram in self.latency.items():
+                group(key)['latency'] = histogram.to_dict()
+            return {
+                'endpoints': endpoints,
+                'json': dict((k, h.to_dict()) for k, h in self.json.items())
+            }
+
+    def prometheus(self, prefix='granoclient'):
+        """ The current values in the Prometheus text exposition format.
+
+        :param prefix: (optional) the prefix of all metric names.
+        """
+        lines = []
+
+        def metric(name, kind, doc, samples):
+            name = '%s_%s' % (prefix, name)
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (name, suffix, _labels(labels),
+                                            _number(value)))
+
+        def histogram(labels, hist):
+            for bound, count in zip(hist.buckets, hist.counts):
+                yield '_bucket', labels + [('le', bound)], count
+            yield '_bucket', labels + [('le', '+Inf')], hist.count
+            yield '_sum', labels, hist.sum
+            yield '_count', labels, hist.count
+
+        def endpoint(key):
+            return [('method', key[0]), ('endpoint', key[1])]
+
+        with self._lock:
+            metric('requests_total', 'counter', 'Requests by status.',
+                   [('', endpoint(k) + [('status', k[2])], v)
+                    for k, v in sorted(self.requests.items())])
+            metric('errors_total', 'counter',
+                   'Requests which received no response.',
+                   [('', endpoint(k) + [('error', k[2])], v)
+                    for k, v in sorted(self.errors.items())])
+            metric('retries_total', 'counter', 'Retried requests.',
+                   [('', endpoint(k), v)
+                    for k, v in sorted(self.retries.items())])
+            metric('bytes_total', 'counter', 'Bytes sent and received.',
+                   [('', endpoint(k) + [('direction', 'sent')], v)
+                    for k, v in sorted(self.bytes_sent.items())] +
+                   [('', endpoint(k) + [('direction', 'received')], v)
+                    for k, v in sorted(self.bytes_received.items())])
+            samples = []
+            for key, hist in sorted(self.latency.items()):
+                samples.extend(histogram(endpoint(key), hist))
+            metric('request_duration_seconds', 'histogram',
+                   'Request latency.', samples)
+            samples = []
+            for operation, hist in sorted(self.json.items()):
+                samples.extend(histogram([('operation', operation)], hist))
+            metric('json_duration_seconds', 'histogram',
+                   'Time spent encoding and decoding JSON.', samples)
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return '<Metrics(%d requests, %d errors, %d retries)>' % \
+            (sum(self.requests.values()), sum(self.errors.values()),
+             sum(self.retries.values()))
+
+
+def _labels(labels):
+    if not len(labels):
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+        value = value.replace('\n', '\\n').encode('utf-8')
+        pairs.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(pairs)
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,135 @@
+import logging
+import threading
+from Queue import Queue
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+class Task(object):
+    """ A unit of work which has been submitted to a :class:`WorkerPool`.
+    The result (or the exception raised) is kept once the task is done.
+    A task is only ever run once, by whichever thread gets to it first; see
+    :meth:`run_or_wait`. """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.exception = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _claim(self):
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+            return True
+
+    def run(self):
+        if not self._claim():
+            return
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as exc:
+            self.exception = exc
+        finally:
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ Block until the task has been run. """
+        self._done.wait(timeout)
+        return self.done
+
+    def run_or_wait(self):
+        """ Run the task on the current thread if no worker has picked it up
+        yet, otherwise wait for it. A worker which depends on another task
+        must use this rather than :meth:`wait`, as the task may be queued
+        behind the worker's own. """
+        self.run()
+        self.wait()
+
+    def get(self):
+        """ Wait for the task and return its result, re-raising any
+        exception that occurred while it was run. """
+        self.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class WorkerPool(object):
+    """ A bounded pool of worker threads. Tasks are run in the order in
+    which they were submitted; once ``max_pending`` tasks are waiting to be
+    picked up, :meth:`submit` blocks until a worker becomes available.
+
+    :param workers: the number of worker threads.
+    :param max_pending: (optional) the number of queued tasks after which
+        new submissions will block. Defaults to twice the number of workers.
+    """
+
+    def __init__(self, workers, max_pending=None):
+        self.workers = workers
+        self.queue = Queue(maxsize=max_pending or workers * 2)
+        self._local = threading.local()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        self._local.worker = True
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                task.run()
+            finally:
+                self.queue.task_done()
+
+    @property
+    def in_worker(self):
+        """ Check if the current thread is one of the pool's workers. """
+        return getattr(self._local, 'worker', False)
+
+    def submit(self, func, *args, **kwargs):
+        """ Schedule ``func`` to be called with the given arguments and
+        return a :class:`Task` to track it. """
+        task = Task(func, args, kwargs)
+        self.queue.put(task)
+        return task
+
+    def imap(self, func, items):
+        """ Apply ``func`` to each of the given items in parallel, yielding
+        the results in the order of the input. Only a bounded number of
+        items is in flight at any time. """
+        pending = deque()
+        for item in items:
+            pending.append(self.submit(func, item))
+            if len(pending) > self.workers * 2:
+                yield pending.popleft().get()
+        while len(pending):
+            yield pending.popleft().get()
+
+    def join(self):
+        """ Wait until all submitted tasks have been run. """
+        self.queue.join()
+
+    def shutdown(self):
+        """ Run all pending tasks, then stop the worker threads. """
+        for thread in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
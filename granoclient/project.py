@@ -1,4 +1,4 @@
-from granoclient.common import GranoResource, GranoCollection
+from granoclient.common import GranoResource, GranoCollection, materialize
 from granoclient.schema import SchemaCollection
 from granoclient.entity import EntityCollection
 from granoclient.relation import RelationCollection
@@ -10,6 +10,10 @@ class Project(GranoResource):
     relations. """
     
     resource_key = 'slug'
+    identity_mapped = True
+    required_fields = ('label',)
+
+    __slots__ = ()
 
     @property
     def endpoint(self):
@@ -48,12 +52,18 @@ class ProjectCollection(GranoCollection):
 
     def by_slug(self, slug):
         """ Load a project based on its slug, i.e. its unique designation.
+        If the project has already been loaded by this client, the existing
+        object is returned; call its ``reload()`` method to update it.
 
         :param slug: the slug of the project to be retrieved.
 
         """
-        status, data = self.client.get(self.endpoint + '/%s' % slug)
-        return self.clazz(self.client, data)
+        project = self._identity(slug)
+        if project is None:
+            status, data = self.client.get(self.endpoint + '/%s' % slug)
+            project = materialize(self.client, self.clazz, data,
+                                  complete=True)
+        return project
 
     def create(self, data):
         """ Create a new project. 
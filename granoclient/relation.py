@@ -1,4 +1,6 @@
-from granoclient.common import GranoResource, GranoCollection
+from granoclient.common import GranoResource, GranoCollection, materialize
+from granoclient.common import Query
+from granoclient.pool import WorkerPool
 from granoclient.schema import Schema
 
 
@@ -7,6 +9,17 @@ class Relation(GranoResource):
     two entities, it can also be used to store data (in the form of properties). """
     
     resource_key = 'id'
+    identity_mapped = True
+    required_fields = ('schema', 'project', 'source', 'target')
+
+    __slots__ = ('_endpoints',)
+
+    def __init__(self, *args, **kwargs):
+        super(Relation, self).__init__(*args, **kwargs)
+        # Entities loaded by an expanding query; holding on to them keeps
+        # them in the client's identity map for as long as the relation
+        # is in use.
+        self._endpoints = None
 
     @property
     def endpoint(self):
@@ -16,7 +29,7 @@ class Relation(GranoResource):
     def project(self):
         """ The :class:`granoclient.Project` to which this relation belongs. """
         from granoclient.project import Project
-        return Project(self.client, self['project'])
+        return materialize(self.client, Project, self['project'])
 
     @property
     def schema(self):
@@ -31,7 +44,7 @@ class Relation(GranoResource):
     def source(self):
         """ The source :class:`granoclient.Entity`. """
         from granoclient.entity import Entity
-        return Entity(self.client, self['source'])
+        return materialize(self.client, Entity, self['source'])
 
     @source.setter
     def set_source(self, source):
@@ -41,13 +54,63 @@ class Relation(GranoResource):
     def target(self):
         """ The target :class:`granoclient.Entity`. """
         from granoclient.entity import Entity
-        return Entity(self.client, self['target'])
+        return materialize(self.client, Entity, self['target'])
     
     @source.setter
     def set_target(self, target):
         self['target'] = target
 
 
+class RelationQuery(Query):
+    """ A query for relations, which can load the full source and target
+    entities of each page of results in bulk. """
+
+    def __init__(self, client, clazz, endpoint, params=None,
+                 expand_workers=0, **kwargs):
+        super(RelationQuery, self).__init__(client, clazz, endpoint,
+                                            params=params, **kwargs)
+        self.expand_workers = expand_workers
+
+    def _options(self):
+        options = super(RelationQuery, self)._options()
+        options['expand_workers'] = self.expand_workers
+        return options
+
+    def expand(self, workers=4):
+        """ Return a version of the query which, for each page of results,
+        loads the source and target entities of all relations on the page
+        before returning them. Each entity is loaded only once, using
+        ``workers`` parallel requests. """
+        return self._derive(self.endpoint, params=self.params,
+                            expand_workers=workers)
+
+    @property
+    def results(self):
+        """ The current page's results. """
+        results = super(RelationQuery, self).results
+        if self.expand_workers and self.result_type == 'resource':
+            results = self._expand(results)
+        return results
+
+    def _expand(self, results):
+        relations = list(results)
+        entities = {}
+        for relation in relations:
+            relation._endpoints = (relation.source, relation.target)
+            for entity in relation._endpoints:
+                if not entity._complete:
+                    entities[entity.id] = entity
+        if len(entities):
+            pool = WorkerPool(min(self.expand_workers, len(entities)))
+            try:
+                for _ in pool.imap(lambda e: e.reload(), entities.values()):
+                    pass
+            finally:
+                pool.shutdown()
+        for relation in relations:
+            yield relation
+
+
 class RelationCollection(GranoCollection):
     """ Represents all the :class:`granoclient.Relation` currently available
     in this instance of grano. Provides functionality to search for, filter
@@ -55,16 +118,56 @@ class RelationCollection(GranoCollection):
     """
 
     clazz = Relation
+    query_clazz = RelationQuery
     endpoint = '/relations'
+    expand_workers = 0
+
+    def query(self, params=None):
+        """ Begin querying the collection. The query can further be refined
+        using the methods of the returned :class:`granoclient.RelationQuery`.
+        """
+        query = super(RelationCollection, self).query(params=params)
+        if self.expand_workers:
+            query = query.expand(self.expand_workers)
+        return query
+
+    def expand(self, workers=4):
+        """ Return a version of the collection which loads the source and
+        target entities of relations in bulk, one page at a time::
+
+            for relation in project.relations.expand():
+                print relation.source.properties, relation.target.properties
+
+        :param workers: (optional) the number of parallel requests.
+        """
+        collection = self.__class__(self.client, params=self.params)
+        collection.expand_workers = workers
+        return collection
 
     def by_id(self, id):
         """ Load a relation based on its id, i.e. its unique designation.
+        If the relation has already been loaded by this client, the existing
+        object is returned; call its ``reload()`` method to update it.
+
+        :param id: the id of the relation to be retrieved.
+
+        """
+        relation = self._identity(id)
+        if relation is None:
+            status, data = self.client.get(self.endpoint + '/%s' % id)
+            relation = materialize(self.client, self.clazz, data,
+                                   complete=True)
+        return relation
+
+    def by_id_async(self, id):
+        """ Load a relation based on its id in the background. This requires
+        an :class:`granoclient.AsyncGrano` client.
 
         :param id: the id of the relation to be retrieved.
 
+        :returns: a task; call its ``get()`` method to get the relation.
         """
-        status, data = self.client.get(self.endpoint + '/%s' % id)
-        return self.clazz(self.client, data)
+        return self._submit(self.by_id, id)
 
     def create(self, data):
         """ Create a new relation. 
@@ -0,0 +1,217 @@
+import json
+import gzip
+import time
+import base64
+import hashlib
+import logging
+from urllib import urlencode
+from urlparse import urlsplit, parse_qsl
+from threading import Lock
+from collections import deque
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+
+
+log = logging.getLogger(__name__)
+
+# Response headers kept in a recording; the cache needs the validators.
+HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+# Request headers which make a GET conditional, see ``ResponseCache``.
+CONDITIONAL = ('If-None-Match', 'If-Modified-Since')
+
+
+def request_key(method, url, headers, body=None):
+    """ The key under which the response to a request is recorded: the
+    method, the path and sorted query of the URL (so that recordings do not
+    depend on the host name or parameter order), whether the request was
+    conditional and a digest of the submitted data, if any. """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    key = '%s %s' % (method, parts.path + ('?' + query if query else ''))
+    if any(h in headers for h in CONDITIONAL):
+        key += ' conditional'
+    digest = _data_digest(headers, body)
+    if digest is not None:
+        key += ' ' + digest
+    return key
+
+
+def _data_digest(headers, body):
+    # The client submits JSON in the ``data`` form field, either URL-encoded
+    # or as part of a multipart body; only that field is used, since the
+    # multipart boundaries differ between runs.
+    if not body or not isinstance(body, basestring):
+        return None
+    content_type = headers.get('Content-Type') or ''
+    if content_type.startswith('multipart/form-data'):
+        data = _multipart_field(body, content_type, 'data')
+    else:
+        data = dict(parse_qsl(body)).get('data')
+    if data is None:
+        return None
+    try:
+        data = json.dumps(json.loads(data), sort_keys=True)
+    except ValueError:
+        pass
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def _multipart_field(body, content_type, name):
+    boundary = content_type.split('boundary=', 1)[-1].strip('"')
+    for part in body.split('--' + boundary):
+        head, sep, content = part.partition('\r\n\r\n')
+        if sep and ('name="%s"' % name) in head:
+            return content[:-2] if content.endswith('\r\n') else content
+
+
+class Recorder(object):
+    """ Writes each request sent by a :class:`granoclient.Client` and the
+    response to it to a gzipped file, one JSON object per line, so that
+    the traffic can later be served by a :class:`ReplayAdapter`::
+
+        grano = Grano(record='import.jsonl.gz')
+        ... run an import ...
+        grano.client.recorder.close()
+
+    Recording reads the complete body of each response, including those
+    requested with ``stream``.
+
+    :param path: the file name of the recording; an existing file is
+        overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = gzip.open(path, 'wb')
+        self._lock = Lock()
+
+    def __call__(self, method, url, response, elapsed):
+        # An ``after_response`` hook.
+        request = response.request
+        content = response.content or ''
+        record = {
+            'key': request_key(method, request.url, request.headers,
+                               request.body),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict((h, response.headers[h]) for h in HEADERS
+                            if h in response.headers),
+            'elapsed': round(elapsed, 6)
+        }
+        try:
+            record['body'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            record['body64'] = base64.b64encode(content)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self.count += 1
+
+    def close(self):
+        """ Finish the recording; further responses are not recorded. """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        log.info('Recorded %d responses to %s', self.count, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<Recorder(%s, %d)>' % (self.path, self.count)
+
+
+class ReplayAdapter(BaseAdapter):
+    """ A transport adapter for ``requests`` which answers requests with the
+    responses from a recording made by a :class:`Recorder`, rather than
+    sending them to a server. This makes it possible to benchmark a loader
+    or a changed client setting against a real import without a server::
+
+        grano = Grano(replay='import.jsonl.gz', replay_speed=2.0)
+
+    Requests are matched by method, path, query, whether they are
+    conditional and the data they submit, so that a recording can be
+    replayed with a different number of loader workers. Identical requests
+    are answered in the order in which they were recorded; once the
+    recorded responses for a request are used up, the last one is
+    repeated. A request which is not in the recording fails with a
+    ``ConnectionError``.
+
+    :param path: the file name of the recording.
+    :param speed: (optional) how much faster than recorded responses are
+        served: each response is delayed by its recorded latency divided by
+        ``speed``. Use ``0`` to serve all responses immediately.
+    """
+
+    def __init__(self, path, speed=1.0):
+        super(ReplayAdapter, self).__init__()
+        self.path = path
+        self.speed = speed
+        self.served = 0
+        self.missed = 0
+        self._responses = {}
+        self._lock = Lock()
+        with gzip.open(path, 'rb') as fh:
+            for line in fh:
+                if line.strip():
+                    record = json.loads(line)
+                    queue = self._responses.setdefault(record['key'],
+                                                       deque())
+                    queue.append(record)
+
+    def _next(self, key):
+        with self._lock:
+            queue = self._responses.get(key)
+            if not queue:
+                self.missed += 1
+                return None
+            self.served += 1
+            if len(queue) > 1:
+                return queue.popleft()
+            return queue[0]
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        key = request_key(request.method, request.url, request.headers,
+                          request.body)
+        record = self._next(key)
+        if record is None:
+            raise ConnectionError('No recorded response for %s' % key,
+                                  request=request)
+        if self.speed:
+            time.sleep(record['elapsed'] / self.speed)
+        return self._response(request, record)
+
+    def _response(self, request, record):
+        response = Response()
+        response.status_code = record['status']
+        response.reason = record.get('reason')
+        response.headers = CaseInsensitiveDict(record.get('headers', {}))
+        if 'body64' in record:
+            response._content = base64.b64decode(record['body64'])
+        else:
+            response._content = record['body'].encode('utf-8')
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return '<ReplayAdapter(%s, %d served, %d missed)>' % \
+            (self.path, self.served, self.missed)
@@ -12,6 +12,9 @@ class Schema(GranoResource):
     :ref:`schema`."""
 
     resource_key = 'name'
+    required_fields = ('label', 'obj')
+
+    __slots__ = ('base_endpoint',)
 
     def __init__(self, client, base_endpoint, data):
         self.base_endpoint = base_endpoint
@@ -39,7 +42,9 @@ class SchemaCollection(GranoCollection):
         using the methods of the returned :class:`granoclient.Query`."""
         clazz = lambda client, data: self.clazz(client, self.endpoint, data)
         return self.query_clazz(self.client, clazz, self.endpoint,
-                                params=params)
+                                params=params,
+                                hydrate_workers=self.hydrate_workers,
+                                result_type=self.result_type)
 
     def __init__(self, client, project_slug):
         self.project_slug = project_slug
@@ -52,7 +57,9 @@ class SchemaCollection(GranoCollection):
 
         """
         status, data = self.client.get(self.endpoint + '/%s' % name)
-        return self.clazz(self.client, self.endpoint, data)
+        schema = self.clazz(self.client, self.endpoint, data)
+        schema.mark_clean()
+        return schema
 
     def create(self, data):
         """ Create a new schema.
@@ -64,7 +71,9 @@ class SchemaCollection(GranoCollection):
         if isinstance(data, Schema):
             data = data._data
         s, data = self.client.post(self.endpoint, data=data)
-        return self.clazz(self.client, self.endpoint, data)
+        schema = self.clazz(self.client, self.endpoint, data)
+        schema.mark_clean()
+        return schema
 
     def upsert(self, data):
         """ Import a schema from an object. This attempts to either create or
@@ -72,6 +81,11 @@ class SchemaCollection(GranoCollection):
         name = data.get('name')
         try:
             schema = self.by_name(name)
+            # The server adds fields of its own, so only those given in the
+            # specification are compared.
+            if _contains(schema._data, data):
+                log.info('Schema unchanged: %s', schema.label)
+                return
             schema._data = data
             schema.save()
             log.info('Updated schema: %s', schema.label)
@@ -88,3 +102,24 @@ class SchemaCollection(GranoCollection):
                 data = [data]
             for schema in data:
                 self.upsert(schema)
+
+
+def _contains(current, spec):
+    """ Check whether all values given in a specification are present in
+    the server's version. Lists of objects with a ``name`` (such as the
+    attributes of a schema) are matched by name, regardless of order. """
+    if isinstance(spec, dict):
+        if not isinstance(current, dict):
+            return False
+        return all(k in current and _contains(current[k], v)
+                   for k, v in spec.items())
+    if isinstance(spec, (list, tuple)):
+        if not isinstance(current, (list, tuple)) or \
+                len(current) != len(spec):
+            return False
+        if all(isinstance(v, dict) and 'name' in v for v in spec):
+            named = dict((c.get('name'), c) for c in current
+                         if isinstance(c, dict))
+            return all(_contains(named.get(v['name']), v) for v in spec)
+        return all(_contains(c, v) for c, v in zip(current, spec))
+    return current == spec
@@ -0,0 +1,403 @@
+import sys
+import json
+import mmap
+import struct
+import logging
+from array import array
+from xml.sax.saxutils import escape, quoteattr
+
+from granoclient.base import GranoException
+
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'GRANOSN1'
+# magic, node count, edge count, offset of the string tables
+HEADER = struct.Struct('<8sIIQ')
+# Arrays which are stored in a snapshot file, in order.
+ARRAYS = ('node_schema', 'edge_source', 'edge_target', 'edge_schema',
+          'out_offsets', 'in_offsets', 'in_edges')
+
+
+class Snapshot(object):
+    """ A compact, read-only copy of the graph of a project for offline
+    analysis. Entities are numbered consecutively; relations are stored in
+    integer arrays sorted by source, with compressed sparse row (CSR)
+    indexes for the outbound and inbound relations of each entity. Schema
+    names and property keys are only stored once.
+
+    Snapshots are made with :meth:`build`, and can be written to a file
+    and memory-mapped again later::
+
+        snapshot = Snapshot.build(project, properties=['name'])
+        snapshot.save('graph.snap')
+        snapshot = Snapshot.load('graph.snap')
+        print snapshot.degree(entity_id), snapshot.neighbours(entity_id)
+
+    Entities and relations are identified by their grano ids in the public
+    methods, and by their position (an integer) internally.
+    """
+
+    def __init__(self):
+        self.node_ids = []
+        self.edge_ids = []
+        self.schemata = []
+        self.keys = []
+        # For each node, a dictionary of property key index to value.
+        self.properties = []
+        self.node_schema = array('i')
+        self.edge_source = array('i')
+        self.edge_target = array('i')
+        self.edge_schema = array('i')
+        self.out_offsets = array('i', [0])
+        self.in_offsets = array('i', [0])
+        self.in_edges = array('i')
+        self._nodes = {}
+        self._schema_index = {}
+        self._key_index = {}
+        self._mmap = None
+
+    @classmethod
+    def build(cls, project, properties=None, workers=4, page_size=100):
+        """ Make a snapshot of all entities and relations in a project.
+
+        :param project: the :class:`granoclient.Project` to copy.
+        :param properties: (optional) the names of the entity properties to
+            keep; by default, none are kept.
+        :param workers: (optional) the number of parallel requests.
+        :param page_size: (optional) the number of resources per request.
+
+        A :class:`granoclient.GranoException` is raised if fewer entities
+        or relations are listed than the server reports in total.
+        """
+        snapshot = cls()
+        keep = set(properties or [])
+        meta = {}
+        for entity in project.entities._export(workers, page_size, 3, meta):
+            snapshot._add_node(entity._data, keep)
+        _check(project.entities, len(snapshot), meta)
+        edges, meta, listed = [], {}, 0
+        for relation in project.relations._export(workers, page_size, 3,
+                                                  meta):
+            listed += 1
+            edge = snapshot._add_edge(relation._data)
+            if edge is not None:
+                edges.append(edge)
+        _check(project.relations, listed, meta)
+        snapshot._index(edges)
+        log.info("Snapshot of %r: %d entities, %d relations", project,
+                 len(snapshot), len(snapshot.edge_ids))
+        return snapshot
+
+    def _intern(self, table, index, value):
+        if value not in index:
+            index[value] = len(table)
+            table.append(value)
+        return index[value]
+
+    def _add_node(self, data, keep):
+        self._nodes[data['id']] = len(self.node_ids)
+        self.node_ids.append(data['id'])
+        schema = _name(data.get('schema'))
+        self.node_schema.append(self._intern(self.schemata,
+                                             self._schema_index, schema))
+        props = {}
+        for key, prop in (data.get('properties') or {}).items():
+            if key in keep:
+                if isinstance(prop, dict):
+                    prop = prop.get('value')
+                props[self._intern(self.keys, self._key_index, key)] = prop
+        self.properties.append(props)
+
+    def _add_edge(self, data):
+        source = self._nodes.get(_name(data.get('source'), 'id'))
+        target = self._nodes.get(_name(data.get('target'), 'id'))
+        if source is None or target is None:
+            log.warning("Relation %s refers to an unknown entity, skipped.",
+                        data.get('id'))
+            return
+        schema = self._intern(self.schemata, self._schema_index,
+                              _name(data.get('schema')))
+        return (source, target, schema, data['id'])
+
+    def _index(self, edges):
+        # Sorted by source, the relations themselves form the outbound
+        # index; the inbound one is built with a counting sort.
+        edges.sort()
+        for source, target, schema, edge_id in edges:
+            self.edge_ids.append(edge_id)
+            self.edge_source.append(source)
+            self.edge_target.append(target)
+            self.edge_schema.append(schema)
+        size = len(self.node_ids)
+        self.out_offsets = _offsets(self.edge_source, size)
+        self.in_offsets = _offsets(self.edge_target, size)
+        fill = array('i', self.in_offsets)
+        self.in_edges = array('i', [0] * len(edges))
+        for edge, target in enumerate(self.edge_target):
+            self.in_edges[fill[target]] = edge
+            fill[target] += 1
+
+    def _node(self, node_id):
+        try:
+            return self._nodes[node_id]
+        except KeyError:
+            raise KeyError('Entity not in snapshot: %r' % node_id)
+
+    def _edges(self, node, direction):
+        if direction in ('outbound', 'both'):
+            for edge in xrange(self.out_offsets[node],
+                               self.out_offsets[node + 1]):
+                yield edge, self.edge_target
+        if direction in ('inbound', 'both'):
+            for i in xrange(self.in_offsets[node], self.in_offsets[node + 1]):
+                yield self.in_edges[i], self.edge_source
+
+    def degree(self, node_id, direction='both'):
+        """ The number of relations of an entity.
+
+        :param node_id: the id of the entity.
+        :param direction: (optional) ``outbound``, ``inbound`` or ``both``.
+        """
+        node = self._node(node_id)
+        degree = 0
+        if direction in ('outbound', 'both'):
+            degree += self.out_offsets[node + 1] - self.out_offsets[node]
+        if direction in ('inbound', 'both'):
+            degree += self.in_offsets[node + 1] - self.in_offsets[node]
+        return degree
+
+    def neighbours(self, node_id, direction='both', schema=None):
+        """ The ids of the entities connected to an entity. An entity
+        connected by several relations is only listed once.
+
+        :param node_id: the id of the entity.
+        :param direction: (optional) ``outbound``, ``inbound`` or ``both``.
+        :param schema: (optional) only follow relations of this schema.
+        """
+        node = self._node(node_id)
+        wanted = None
+        if schema is not None:
+            if schema not in self._schema_index:
+                return []
+            wanted = self._schema_index[schema]
+        seen = set()
+        neighbours = []
+        for edge, ends in self._edges(node, direction):
+            if wanted is not None and self.edge_schema[edge] != wanted:
+                continue
+            other = ends[edge]
+            if other not in seen:
+                seen.add(other)
+                neighbours.append(self.node_ids[other])
+        return neighbours
+
+    def relations(self, node_id, direction='both'):
+        """ The relations of an entity, as ``(relation id, source id,
+        target id, schema)`` tuples. """
+        node = self._node(node_id)
+        for edge, ends in self._edges(node, direction):
+            yield self._relation(edge)
+
+    def _relation(self, edge):
+        return (self.edge_ids[edge],
+                self.node_ids[self.edge_source[edge]],
+                self.node_ids[self.edge_target[edge]],
+                self.schemata[self.edge_schema[edge]])
+
+    def schema(self, node_id):
+        """ The schema name of an entity. """
+        return self.schemata[self.node_schema[self._node(node_id)]]
+
+    def property(self, node_id, key, default=None):
+        """ The value of a property of an entity, if it was kept when the
+        snapshot was built. """
+        if key not in self._key_index:
+            return default
+        props = self.properties[self._node(node_id)]
+        return props.get(self._key_index[key], default)
+
+    def save(self, path):
+        """ Write the snapshot to a file, which can be memory-mapped using
+        :meth:`load`. """
+        with open(path, 'wb') as fh:
+            fh.write(HEADER.pack(MAGIC, 0, 0, 0))
+            for name in ARRAYS:
+                data = array('i', getattr(self, name))
+                if sys.byteorder != 'little':
+                    data.byteswap()
+                fh.write(data.tostring())
+            tables_offset = fh.tell()
+            json.dump({
+                'node_ids': self.node_ids,
+                'edge_ids': self.edge_ids,
+                'schemata': self.schemata,
+                'keys': self.keys,
+                'properties': [sorted(p.items()) for p in self.properties]
+            }, fh)
+            fh.seek(0)
+            fh.write(HEADER.pack(MAGIC, len(self.node_ids),
+                                 len(self.edge_ids), tables_offset))
+
+    @classmethod
+    def load(cls, path):
+        """ Open a snapshot file written by :meth:`save`. The adjacency
+        arrays are read from the memory-mapped file as they are used,
+        rather than being loaded into memory. """
+        snapshot = cls()
+        with open(path, 'rb') as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, nodes, edges, tables_offset = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a snapshot file: %r' % path)
+        sizes = {
+            'node_schema': nodes,
+            'edge_source': edges,
+            'edge_target': edges,
+            'edge_schema': edges,
+            'out_offsets': nodes + 1,
+            'in_offsets': nodes + 1,
+            'in_edges': edges
+        }
+        offset = HEADER.size
+        for name in ARRAYS:
+            setattr(snapshot, name, _MappedArray(mapped, offset, sizes[name]))
+            offset += sizes[name] * _MappedArray.ITEM.size
+        tables = json.loads(mapped[tables_offset:])
+        snapshot.node_ids = tables['node_ids']
+        snapshot.edge_ids = tables['edge_ids']
+        snapshot.schemata = tables['schemata']
+        snapshot.keys = tables['keys']
+        snapshot.properties = [dict(p) for p in tables['properties']]
+        snapshot._nodes = _positions(snapshot.node_ids)
+        snapshot._schema_index = _positions(snapshot.schemata)
+        snapshot._key_index = _positions(snapshot.keys)
+        snapshot._mmap = mapped
+        return snapshot
+
+    def close(self):
+        """ Release the file of a snapshot opened with :meth:`load`. """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def to_csv(self, nodes_fh, edges_fh):
+        """ Write the entities and relations to two CSV files. The
+        entity file has the columns ``id``, ``schema`` and one per kept
+        property; the relation file has ``id``, ``source``, ``target`` and
+        ``schema``. """
+        import csv
+        nodes = csv.writer(nodes_fh)
+        nodes.writerow(['id', 'schema'] + self.keys)
+        for node, node_id in enumerate(self.node_ids):
+            props = self.properties[node]
+            row = [node_id, self.schemata[self.node_schema[node]]]
+            row.extend(props.get(k) for k in range(len(self.keys)))
+            nodes.writerow([_encode(v) for v in row])
+        edges = csv.writer(edges_fh)
+        edges.writerow(['id', 'source', 'target', 'schema'])
+        for edge in xrange(len(self.edge_ids)):
+            edges.writerow([_encode(v) for v in self._relation(edge)])
+
+    def to_graphml(self, fh):
+        """ Write the graph as GraphML, e.g. for use with Gephi or
+        networkx. """
+        fh.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                 '<key id="schema" for="all" attr.name="schema" '
+                 'attr.type="string"/>\n')
+        for i, key in enumerate(self.keys):
+            fh.write('<key id="p%d" for="node" attr.name=%s '
+                     'attr.type="string"/>\n' % (i, _encode(quoteattr(key))))
+        fh.write('<graph edgedefault="directed">\n')
+        for node, node_id in enumerate(self.node_ids):
+            fh.write('<node id=%s>' % _encode(quoteattr(unicode(node_id))))
+            fh.write(_data('schema', self.schemata[self.node_schema[node]]))
+            for key, value in sorted(self.properties[node].items()):
+                if value is not None:
+                    fh.write(_data('p%d' % key, value))
+            fh.write('</node>\n')
+        for edge in xrange(len(self.edge_ids)):
+            edge_id, source, target, schema = self._relation(edge)
+            fh.write('<edge id=%s source=%s target=%s>%s</edge>\n' % (
+                _encode(quoteattr(unicode(edge_id))),
+                _encode(quoteattr(unicode(source))),
+                _encode(quoteattr(unicode(target))),
+                _data('schema', schema)))
+        fh.write('</graph>\n</graphml>\n')
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes
+
+    def __repr__(self):
+        return '<Snapshot(%d entities, %d relations)>' % \
+            (len(self.node_ids), len(self.edge_ids))
+
+
+class _MappedArray(object):
+    """ A read-only integer array stored in a memory-mapped file. """
+
+    ITEM = struct.Struct('<i')
+
+    def __init__(self, mapped, offset, length):
+        self.mapped = mapped
+        self.offset = offset
+        self.length = length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('array index out of range')
+        return self.ITEM.unpack_from(self.mapped,
+                                     self.offset + i * self.ITEM.size)[0]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in xrange(self.length):
+            yield self[i]
+
+
+def _offsets(ends, size):
+    # CSR row offsets: the relations of node n are found at positions
+    # offsets[n] to offsets[n + 1] of the index.
+    offsets = array('i', [0] * (size + 1))
+    for node in ends:
+        offsets[node + 1] += 1
+    for node in xrange(size):
+        offsets[node + 1] += offsets[node]
+    return offsets
+
+
+def _check(collection, listed, meta):
+    # A truncated listing would leave entities out and drop the relations
+    # which refer to them.
+    total = meta.get('total')
+    if total is not None and listed < total:
+        raise GranoException('Snapshot is incomplete: listed %d of %d in '
+                             '%r.' % (listed, total, collection))
+
+
+def _positions(table):
+    return dict((value, i) for i, value in enumerate(table))
+
+
+def _name(value, key='name'):
+    if isinstance(value, dict):
+        return value.get(key)
+    return value
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _data(key, value):
+    return '<data key="%s">%s</data>' % (key, _encode(escape(unicode(value))))
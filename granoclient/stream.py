@@ -0,0 +1,110 @@
+import re
+import json
+import codecs
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+
+
+class _Buffer(object):
+    """ A window on a stream of JSON text, which is extended chunk by chunk
+    as the parser needs more data. """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.pos > len(self.text) / 2:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            self.text += self.decoder.decode('', final=True)
+            return False
+        if isinstance(chunk, unicode):
+            self.text += chunk
+        else:
+            self.text += self.decoder.decode(chunk)
+        return True
+
+    def peek(self):
+        """ Skip any whitespace and return the next character. """
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON data.')
+
+    def take(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, char):
+        if self.take() != char:
+            raise ValueError('Expected %r at position %d.' % (char, self.pos))
+
+    def value(self):
+        """ Decode the next complete JSON value. """
+        self.peek()
+        while True:
+            try:
+                obj, end = DECODER.raw_decode(self.text, self.pos)
+                # A number at the very end of the buffer may be cut off;
+                # only accept a value once the data following it has arrived.
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_array(chunks, meta, key='results'):
+    """ Incrementally decode a JSON object, such as a page of query results,
+    from an iterable of byte chunks. The elements of the array stored under
+    ``key`` are yielded as soon as they have been received, all other
+    top-level keys of the object are stored in ``meta``.
+
+    :param chunks: the body of a response, e.g. from
+        ``response.iter_content()``.
+    :param meta: a dictionary which will receive all keys of the object,
+        except for ``key``.
+    :param key: the name of the array to stream.
+    """
+    buf = _Buffer(chunks)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        name = buf.value()
+        buf.expect(':')
+        if name == key and buf.peek() == '[':
+            buf.take()
+            if buf.peek() == ']':
+                buf.take()
+            else:
+                while True:
+                    yield buf.value()
+                    char = buf.take()
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise ValueError('Expected "," or "]" at position '
+                                         '%d.' % buf.pos)
+        else:
+            meta[name] = buf.value()
+        char = buf.take()
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expected "," or "}" at position %d.' % buf.pos)
@@ -0,0 +1,220 @@
+import json
+import sqlite3
+import logging
+from collections import Counter
+
+from granoclient.common import _pages
+from granoclient.pool import WorkerPool
+
+
+log = logging.getLogger(__name__)
+
+KINDS = ('schema', 'entity', 'relation')
+
+
+class Mirror(object):
+    """ A local copy of the schemata, entities and relations of a project,
+    stored in an SQLite database and kept up to date incrementally::
+
+        mirror = Mirror(project, 'project.db')
+        mirror.sync()
+        for entity in mirror.all('entity'):
+            ...
+
+    For each kind of record, the mirror keeps a high-water mark: the
+    largest value of ``cursor_field`` (e.g. a modification time) seen so
+    far. :meth:`sync` passes the mark to the server as the query argument
+    ``cursor_param``, so that only records changed since the last run are
+    transferred, and upserts them into the mirror. Records which are older
+    than the mark are ignored, so a server which does not support the
+    argument makes a sync slower, but not wrong. Schemata are few and are
+    always copied completely.
+
+    Incremental syncs do not notice deleted records; :meth:`reconcile`
+    compares the complete list of records with the mirror and removes
+    those no longer on the server.
+
+    :param project: the :class:`granoclient.Project` to mirror.
+    :param path: the file name of the database; it will be created if it
+        does not exist yet.
+    :param cursor_field: (optional) the field of a record which grows
+        whenever it is changed.
+    :param cursor_param: (optional) the query argument used to request the
+        records changed since a given value of ``cursor_field``.
+    :param full: (optional) store the full representation of each record,
+        rather than the shortened one returned in query results. This takes
+        an additional request per changed record.
+    :param workers: (optional) the number of parallel requests made to
+        load full representations and during :meth:`reconcile`.
+    :param page_size: (optional) the number of records per request.
+    """
+
+    def __init__(self, project, path, cursor_field='updated_at',
+                 cursor_param='updated_since', full=False, workers=4,
+                 page_size=100):
+        self.project = project
+        self.path = path
+        self.cursor_field = cursor_field
+        self.cursor_param = cursor_param
+        self.full = full
+        self.workers = workers
+        self.page_size = page_size
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS records '
+                           '(kind TEXT, id TEXT, data TEXT, '
+                           'PRIMARY KEY (kind, id))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS marks '
+                           '(kind TEXT PRIMARY KEY, mark TEXT)')
+        self._conn.commit()
+
+    def _collection(self, kind):
+        if kind == 'schema':
+            return self.project.schemata
+        if kind == 'entity':
+            return self.project.entities
+        if kind == 'relation':
+            return self.project.relations
+        raise ValueError('Invalid kind: %r' % kind)
+
+    def mark(self, kind):
+        """ The high-water mark for a kind of record, or ``None`` if it has
+        not been synced yet. """
+        cur = self._conn.execute('SELECT mark FROM marks WHERE kind = ?',
+                                 (kind,))
+        row = cur.fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def sync(self):
+        """ Fetch all records changed since the last sync and store them in
+        the mirror. Returns the number of records stored for each kind. """
+        counts = Counter()
+        for kind in KINDS:
+            mark = self.mark(kind) if kind != 'schema' else None
+            query = self._collection(kind).query().limit(self.page_size)
+            if mark is not None:
+                query = query.filter(self.cursor_param, mark)
+            records = self._records(query, mark)
+            highest = mark
+            for data in self._load(kind, records):
+                cursor = data.get(self.cursor_field)
+                if cursor is not None and (highest is None or
+                                           cursor > highest):
+                    highest = cursor
+                self._store(kind, data)
+                counts[kind] += 1
+            if highest is not None and highest != mark:
+                self._conn.execute('INSERT OR REPLACE INTO marks (kind, mark) '
+                                   'VALUES (?, ?)',
+                                   (kind, json.dumps(highest)))
+            self._conn.commit()
+            log.info("Synced %d %s records of %r", counts[kind], kind,
+                     self.project)
+        return counts
+
+    def reconcile(self):
+        """ Compare the mirror with the complete list of records on the
+        server: all records are stored again, and those which no longer
+        exist on the server are removed. If fewer records are listed than
+        the server reports in total, none of that kind are removed. Returns
+        the number of records removed for each kind. """
+        removed = Counter()
+        for kind in KINDS:
+            meta = {}
+            collection = self._collection(kind)
+            if kind == 'schema':
+                query = collection.query()
+                records = self._records(query, None)
+            else:
+                query = None
+                records = (r._data for r in collection._export(
+                    self.workers, self.page_size, 3, meta))
+            seen = set()
+            for data in self._load(kind, records):
+                seen.add(self._key(kind, data))
+                self._store(kind, data)
+            total = query.total if query is not None else meta.get('total')
+            if total is not None and len(seen) < total:
+                # A truncated listing would delete records which still
+                # exist on the server.
+                log.warning("Listed %d of %d %s records of %r, not removing "
+                            "any.", len(seen), total, kind, self.project)
+                self._conn.commit()
+                continue
+            for (key,) in list(self._conn.execute('SELECT id FROM records '
+                                                  'WHERE kind = ?', (kind,))):
+                if key not in seen:
+                    self._conn.execute('DELETE FROM records WHERE kind = ? '
+                                       'AND id = ?', (kind, key))
+                    removed[kind] += 1
+            self._conn.commit()
+            log.info("Reconciled %s records of %r, %d removed", kind,
+                     self.project, removed[kind])
+        return removed
+
+    def _records(self, query, mark):
+        for page in _pages(query):
+            for obj in page.results:
+                cursor = obj._data.get(self.cursor_field)
+                if mark is not None and cursor is not None and \
+                        cursor < mark:
+                    continue
+                yield obj._data
+
+    def _load(self, kind, records):
+        # Trade the shortened representations for full ones, if needed.
+        if not self.full:
+            return records
+        return self._reload(kind, records)
+
+    def _reload(self, kind, records):
+        endpoint = self._collection(kind).endpoint
+
+        def fetch(data):
+            url = endpoint + '/%s' % self._key(kind, data)
+            return self.project.client.get(url)[1]
+
+        pool = WorkerPool(self.workers)
+        try:
+            for data in pool.imap(fetch, records):
+                yield data
+        finally:
+            pool.shutdown()
+
+    def _key(self, kind, data):
+        return unicode(data['name'] if kind == 'schema' else data['id'])
+
+    def _store(self, kind, data):
+        self._conn.execute('INSERT OR REPLACE INTO records (kind, id, data) '
+                           'VALUES (?, ?, ?)', (kind, self._key(kind, data),
+                                                json.dumps(data)))
+
+    def get(self, kind, id):
+        """ Get a record from the mirror, or ``None`` if it is not known.
+
+        :param kind: ``schema``, ``entity`` or ``relation``.
+        :param id: the id of the record (or the name, for schemata).
+        """
+        cur = self._conn.execute('SELECT data FROM records WHERE kind = ? '
+                                 'AND id = ?', (kind, unicode(id)))
+        row = cur.fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def all(self, kind):
+        """ Iterate over all records of a kind in the mirror. """
+        cur = self._conn.execute('SELECT data FROM records WHERE kind = ?',
+                                 (kind,))
+        for (data,) in cur:
+            yield json.loads(data)
+
+    def count(self, kind):
+        cur = self._conn.execute('SELECT COUNT(*) FROM records '
+                                 'WHERE kind = ?', (kind,))
+        return cur.fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __repr__(self):
+        return '<Mirror(%r, %s)>' % (self.project, self.path)